@@ -1,10 +1,12 @@
 import re
+from datetime import datetime
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.filters import Filter, CommandStart, Command
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import ADMIN
 
@@ -14,11 +16,16 @@ from app.admin_keyboards import (admin_main_keyboard, admin_settings_menu, netwo
                                  order_info_menu, admin_build_orders_keyboard)
 from app.database.requests import (get_wallets, get_rate, get_support_contact, update_rate,
                                    update_support_contact, add_wallet, delete_wallet,
-                                   update_order_status, get_order_info, get_user_info)
+                                   transition_order_status, get_order_info, get_user_info, get_orders_volume)
+from app.order_status import OrderStatus
+from app.outbox import outbox_message, wake_outbox
+from app.money import parse_amount, uah_amount, format_amount, format_rate
 from app.states import (ExchangeRateChange, SupportContactChange, WalletManagement, OrderCancellation, OrderInfo,
                         UserInfo, AdminOrderInfo, Mailing)
 
 from app.admin_func.mailing import start_mailing
+from app.metrics import metrics
+from app.user_keyboard import parse_order_list_callback
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -40,6 +47,11 @@ async def cmd_start(message: Message):
     await message.answer('Добро пожаловать в бот, администратор!', reply_markup=admin_main_keyboard)
 
 
+@admin.message(Admin(), Command('metrics'))
+async def show_metrics(message: Message):
+    await message.answer(metrics.render())
+
+
 @admin.message(F.text == 'Редактировать настройки бота⚙️')
 async def bot_settings_info(message: Message):
     # Получаем данные из БД
@@ -51,7 +63,7 @@ async def bot_settings_info(message: Message):
     wallet_info = "\n".join([f"Сеть: {wallet.network}, Кошелек: {wallet.address}" for wallet in wallets])
 
     info_message = (
-        f"📊 Текущий курс: {rate_value}\n\n"
+        f"📊 Текущий курс: {format_rate(rate_value) if rate_value is not None else 'не задан'}\n\n"
         f"📞 Контакт поддержки: {support_contact}\n\n"
         f"💼 Кошельки: {wallet_info}"
     )
@@ -69,7 +81,7 @@ async def rate_exchange_change(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.message(ExchangeRateChange.waiting_for_new_exchange_rate)
-async def process_rate_change(message: Message, state: FSMContext):
+async def process_rate_change(message: Message, state: FSMContext, session: AsyncSession):
     new_exchange_rate = message.text
 
     # Проверка на значения с плавающей точкой
@@ -77,10 +89,10 @@ async def process_rate_change(message: Message, state: FSMContext):
         await message.answer('Пожалуйста, введите корректный курс\n Через точку, в формате  41.72, 42.0 и т.д.')
         return
 
-    new_exchange_rate = float(new_exchange_rate)
+    new_exchange_rate = parse_amount(new_exchange_rate)
 
     # Обновляем курс в базе данных
-    await update_rate(new_exchange_rate)
+    await update_rate(new_exchange_rate, session=session)
 
     await message.answer(f"Курс успешно обновлен на: {new_exchange_rate}")
 
@@ -99,7 +111,7 @@ async def support_contact_change(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.message(SupportContactChange.waiting_for_new_support_contact)
-async def process_contact_change(message: Message, state: FSMContext):
+async def process_contact_change(message: Message, state: FSMContext, session: AsyncSession):
     new_support_contact = message.text
 
     # Проверка на числовой формат и длину номера карты
@@ -108,7 +120,7 @@ async def process_contact_change(message: Message, state: FSMContext):
         return
 
     # Обновляем контакт в базе данных
-    await update_support_contact(new_support_contact)
+    await update_support_contact(new_support_contact, session=session)
 
     await message.answer(f"Контакт успешно обновлен на: {new_support_contact}")
 
@@ -150,7 +162,7 @@ async def process_network(message: Message, state: FSMContext):
 
 # Хендлер для состояния ожидания адреса
 @admin.message(WalletManagement.waiting_for_address)
-async def process_address(message: Message, state: FSMContext):
+async def process_address(message: Message, state: FSMContext, session: AsyncSession):
     if message.text == "Выйти🚪":
         await state.clear()
         await message.answer("Вы вернулись в главное меню.", reply_markup=admin_main_keyboard)
@@ -162,7 +174,7 @@ async def process_address(message: Message, state: FSMContext):
 
     try:
         # Добавляем новый кошелек в базу данных
-        await add_wallet(network, address)
+        await add_wallet(network, address, session=session)
         await message.answer(f"Кошелек успешно добавлен:\nСеть: {network}\nАдрес: {address}")
 
     except Exception as e:
@@ -185,12 +197,12 @@ async def delete_wallets(callback: CallbackQuery, state: FSMContext):
 
 # Хендлер для состояния ожидания адреса
 @admin.message(WalletManagement.waiting_for_delete_address)  # Changed from waiting_for_address
-async def process_delete_address(message: Message, state: FSMContext):
+async def process_delete_address(message: Message, state: FSMContext, session: AsyncSession):
     address = message.text
 
     try:
         # Удаляем кошелек из базы данных
-        result = await delete_wallet(address)  # Added await here
+        result = await delete_wallet(address, session=session)  # Added await here
 
         if result:
             await message.answer(f"Кошелек с адресом {address} успешно удален.")
@@ -208,7 +220,7 @@ async def process_delete_address(message: Message, state: FSMContext):
 
 
 @admin.callback_query(F.data == "order_finished")
-async def finish_order(callback: CallbackQuery):
+async def finish_order(callback: CallbackQuery, session: AsyncSession):
     try:
         # Get order ID from caption instead of text
         message_caption = callback.message.caption
@@ -217,11 +229,18 @@ async def finish_order(callback: CallbackQuery):
 
         order_id = int(message_caption.split('ID ордера: ')[1].split('\n')[0])
 
-        # Update order status in database
-        await update_order_status(order_id, "Ордер завершен администратором✅")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        # Update order status in one conditional UPDATE, the user notification goes to outbox in the same transaction
+        order_info = await transition_order_status(
+            order_id, OrderStatus.COMPLETED,
+            notifications=[outbox_message(f"✅ Ваш ордер #{order_id} был успешно завершен администратором!",
+                                          dedupe_key=f"order:{order_id}:status:{OrderStatus.COMPLETED.value}")],
+            session=session
+        )
+        if not order_info:
+            # Ордер уже завершён или отменён, например другим администратором
+            await callback.answer("Ордер уже обработан", show_alert=True)
+            return
+        wake_outbox()
 
         if order_info:
             # Format updated message
@@ -230,9 +249,9 @@ async def finish_order(callback: CallbackQuery):
                 f"📋 Информация о заказе:\n"
                 f"🔢 ID ордера: {order_info['id']}\n"
                 f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-                f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+                f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты: {order_info['bank_card']}\n"
                 f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -245,15 +264,6 @@ async def finish_order(callback: CallbackQuery):
                 reply_markup=admin_order_actions
             )
 
-            # Notify user about order completion
-            try:
-                await callback.bot.send_message(
-                    order_info['user_id'],
-                    f"✅ Ваш ордер #{order_info['id']} был успешно завершен администратором!"
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user about order completion: {e}")
-
         await callback.answer("Ордер успешно завершен!")
 
     except Exception as e:
@@ -295,7 +305,7 @@ async def cancel_order_warning(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.message(OrderCancellation.waiting_for_confirmation, F.text == "Отменить❌")
-async def confirm_cancel_order(message: Message, state: FSMContext):
+async def confirm_cancel_order(message: Message, state: FSMContext, session: AsyncSession):
     try:
         # Get order ID and message info from state
         data = await state.get_data()
@@ -303,11 +313,19 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
         original_message_id = data.get('message_id')
         chat_id = data.get('chat_id')
 
-        # Update order status in database
-        await update_order_status(order_id, "Ордер отменен администратором❌")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        # Update order status in one conditional UPDATE, the user notification goes to outbox in the same transaction
+        order_info = await transition_order_status(
+            order_id, OrderStatus.CANCELED_BY_ADMIN,
+            notifications=[outbox_message(f"❌ Ваш ордер #{order_id} был отменен администратором",
+                                          dedupe_key=f"order:{order_id}:status:{OrderStatus.CANCELED_BY_ADMIN.value}")],
+            session=session
+        )
+        if not order_info:
+            # Ордер уже завершён или отменён, например другим администратором
+            await message.answer("Ордер уже обработан", reply_markup=admin_main_keyboard)
+            await state.clear()
+            return
+        wake_outbox()
 
         if order_info:
             # Format updated message
@@ -316,9 +334,9 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
                 f"📋 Информация о заказе:\n"
                 f"🔢 ID ордера: {order_info['id']}\n"
                 f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-                f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+                f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты: {order_info['bank_card']}\n"
                 f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -346,15 +364,6 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
                     text=updated_message
                 )
 
-            # Notify the user about order cancellation
-            try:
-                await message.bot.send_message(
-                    order_info['user_id'],
-                    f"❌ Ваш ордер #{order_info['id']} был отменен администратором"
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user about order cancellation: {e}")
-
         await message.answer("Ордер успешно отменен!", reply_markup=admin_main_keyboard)
         await state.clear()
 
@@ -395,7 +404,7 @@ async def cancel_order_warning(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.message(OrderCancellation.waiting_for_confirmation, F.text == "Отменить❌")
-async def confirm_cancel_order(message: Message, state: FSMContext):
+async def confirm_cancel_order(message: Message, state: FSMContext, session: AsyncSession):
     try:
         # Get order ID and message info from state
         data = await state.get_data()
@@ -403,11 +412,19 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
         original_message_id = data.get('message_id')
         chat_id = data.get('chat_id')
 
-        # Update order status in database
-        await update_order_status(order_id, "Ордер отменен администратором")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        # Update order status in one conditional UPDATE, the user notification goes to outbox in the same transaction
+        order_info = await transition_order_status(
+            order_id, OrderStatus.CANCELED_BY_ADMIN,
+            notifications=[outbox_message(f"❌ Ваш ордер #{order_id} был отменен администратором",
+                                          dedupe_key=f"order:{order_id}:status:{OrderStatus.CANCELED_BY_ADMIN.value}")],
+            session=session
+        )
+        if not order_info:
+            # Ордер уже завершён или отменён, например другим администратором
+            await message.answer("Ордер уже обработан", reply_markup=admin_main_keyboard)
+            await state.clear()
+            return
+        wake_outbox()
 
         if order_info:
             # Format updated message
@@ -416,9 +433,9 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
                 f"📋 Информация о заказе:\n"
                 f"🔢 ID ордера: {order_info['id']}\n"
                 f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {order_info['value']} {order_info['currency']} "
-                f"(≈ {float(order_info['value']):.2f} {'UAH' if order_info['currency'] == 'USDT' else 'USDT'})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {format_amount(order_info['value'])} {order_info['currency']} "
+                f"(≈ {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH)\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты: {order_info['bank_card']}\n"
                 f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -432,15 +449,6 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
                 text=updated_message
             )
 
-            # Notify the user about order cancellation
-            try:
-                await message.bot.send_message(
-                    order_info['user_id'],
-                    f"❌ Ваш ордер #{order_info['id']} был отменен администратором"
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user about order cancellation: {e}")
-
         await message.answer("Ордер успешно отменен!", reply_markup=admin_main_keyboard)
         await state.clear()
 
@@ -451,7 +459,7 @@ async def confirm_cancel_order(message: Message, state: FSMContext):
 
 
 @admin.message(OrderCancellation.waiting_for_confirmation, F.text == "Завершить✅")
-async def confirm_finish_order(message: Message, state: FSMContext):
+async def confirm_finish_order(message: Message, state: FSMContext, session: AsyncSession):
     try:
         # Get order ID and message info from state
         data = await state.get_data()
@@ -459,11 +467,19 @@ async def confirm_finish_order(message: Message, state: FSMContext):
         original_message_id = data.get('message_id')
         chat_id = data.get('chat_id')
 
-        # Update order status in database
-        await update_order_status(order_id, "Ордер завершен администратором✅")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        # Update order status in one conditional UPDATE, the user notification goes to outbox in the same transaction
+        order_info = await transition_order_status(
+            order_id, OrderStatus.COMPLETED,
+            notifications=[outbox_message(f"✅ Ваш ордер № {order_id} был завершен администратором",
+                                          dedupe_key=f"order:{order_id}:status:{OrderStatus.COMPLETED.value}")],
+            session=session
+        )
+        if not order_info:
+            # Ордер уже завершён или отменён, например другим администратором
+            await message.answer("Ордер уже обработан", reply_markup=admin_main_keyboard)
+            await state.clear()
+            return
+        wake_outbox()
 
         if order_info:
             # Format updated message
@@ -472,9 +488,9 @@ async def confirm_finish_order(message: Message, state: FSMContext):
                 f"📋 Информация о заказе:\n"
                 f"🔢 ID ордера: {order_info['id']}\n"
                 f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {order_info['value']} {order_info['currency']} "
-                f"(≈ {float(order_info['value']):.2f} {'UAH' if order_info['currency'] == 'USDT' else 'USDT'})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {format_amount(order_info['value'])} {order_info['currency']} "
+                f"(≈ {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH)\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты: {order_info['bank_card']}\n"
                 f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -488,15 +504,6 @@ async def confirm_finish_order(message: Message, state: FSMContext):
                 text=updated_message
             )
 
-            # Notify the user about order cancellation
-            try:
-                await message.bot.send_message(
-                    order_info['user_id'],
-                    f"✅ Ваш ордер № {order_info['id']} был завершен администратором"
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user about order finishing: {e}")
-
         await message.answer("Ордер успешно завершен!", reply_markup=admin_main_keyboard)
         await state.clear()
 
@@ -513,10 +520,20 @@ async def cancel_order_cancellation(message: Message, state: FSMContext):
 
 
 @admin.message(F.text == "Информация об ордерах💸")
-async def admin_order_menu(message: Message):
-    await message.answer("Тут вы можете искать ордер по ID или просмотреть списком",
-                         reply_markup=order_info_menu
-                         )
+async def admin_order_menu(message: Message, session: AsyncSession):
+    # Объём завершенных ордеров считается в базе через SUM по value_minor
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    completed_today = await get_orders_volume([OrderStatus.COMPLETED], since=today, session=session)
+    completed_total = await get_orders_volume([OrderStatus.COMPLETED], session=session)
+
+    await message.answer(
+        f"✅ Завершено сегодня: {completed_today['count']} "
+        f"({format_amount(completed_today['usdt'])} USDT)\n"
+        f"✅ Завершено всего: {completed_total['count']} "
+        f"({format_amount(completed_total['usdt'])} USDT)\n\n"
+        f"Тут вы можете искать ордер по ID или просмотреть списком",
+        reply_markup=order_info_menu
+    )
 
 
 @admin.callback_query(F.data == "search_order")
@@ -530,7 +547,7 @@ async def search_order(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.message(AdminOrderInfo.waiting_for_order_id)
-async def process_admin_order_id(message: Message, state: FSMContext):
+async def process_admin_order_id(message: Message, state: FSMContext, session: AsyncSession):
     if message.text == "Выйти в меню🚪":
         await message.answer("Вы вернулись в главное меню", reply_markup=admin_main_keyboard)
         await state.clear()
@@ -541,7 +558,7 @@ async def process_admin_order_id(message: Message, state: FSMContext):
         return
 
     order_id = int(message.text)
-    order_info = await get_order_info(order_id)
+    order_info = await get_order_info(order_id, session=session)
 
     if order_info is None:
         await message.answer("Ордер с таким ID не найден", reply_markup=admin_main_keyboard)
@@ -553,9 +570,9 @@ async def process_admin_order_id(message: Message, state: FSMContext):
         f"🔢 ID: {order_info['id']}\n"
         f"👤 Пользователь: {order_info['user_id']}\n"
         f"💰 Исходная валюта: {order_info['currency']}\n"
-        f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-        f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-        f"💱Курс обмена: {order_info['exchange_rate']}\n"
+        f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+        f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+        f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
         f"🌐 Сеть: {order_info['network']}\n"
         f"💳 Номер карты: {order_info['bank_card']}\n"
         f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -578,7 +595,7 @@ async def request_user_id(message: Message, state: FSMContext):
 
 
 @admin.message(UserInfo.waiting_for_user_id)
-async def admin_process_user_id(message: Message, state: FSMContext):
+async def admin_process_user_id(message: Message, state: FSMContext, session: AsyncSession):
     # Проверяем, если админ нажал "Выйти в меню"
     if message.text == "Выйти в меню🚪":
         await message.answer("Вы вернулись в главное меню", reply_markup=admin_main_keyboard)
@@ -593,7 +610,7 @@ async def admin_process_user_id(message: Message, state: FSMContext):
         return
 
     user_id = int(message.text)
-    user_info = await get_user_info(user_id)
+    user_info = await get_user_info(user_id, session=session)
 
     if user_info is None:
         await message.answer(
@@ -635,14 +652,17 @@ async def exit_to_menu(message: Message, state: FSMContext):
 
 
 @admin.callback_query(F.data.in_({"order_list"}) | F.data.startswith("order_list_"))
-async def order_list_handler(callback: CallbackQuery):
+async def order_list_handler(callback: CallbackQuery, session: AsyncSession):
     try:
         command = callback.data
-        page = 1 if command == "order_list" else int(command.split("_")[-1])
+        if command == "order_list":
+            page, direction, cursor = 1, "next", None
+        else:
+            page, direction, cursor = parse_order_list_callback(command, "order_list_")
         user_id = callback.from_user.id
         logging.info(f"Handling order list for user {user_id}, command: {command}, page: {page}")
 
-        keyboard = await admin_build_orders_keyboard(page, user_id)
+        keyboard = await admin_build_orders_keyboard(page, user_id, direction, cursor, session=session)
         if not keyboard:
             logging.info(f"No keyboard generated for user {user_id}, page {page}")
             await callback.answer("Нет ордеров для отображения")
@@ -670,15 +690,15 @@ async def order_list_handler(callback: CallbackQuery):
 
 
 @admin.callback_query(F.data.startswith("admin_order_info_"))
-async def order_info_handler(callback: CallbackQuery):
+async def order_info_handler(callback: CallbackQuery, session: AsyncSession):
     """Обработчик просмотра информации об ордере"""
     try:
         # Извлекаем ID ордера из callback_data
         order_id = int(callback.data.split('_')[-1])
-        order_info = await get_order_info(order_id)
+        order_info = await get_order_info(order_id, session=session)
 
         # Получаем информацию об ордере
-        order_info = await get_order_info(order_id)
+        order_info = await get_order_info(order_id, session=session)
 
         if not order_info:
             await callback.answer("Ордер не найден")
@@ -690,9 +710,9 @@ async def order_info_handler(callback: CallbackQuery):
             f"🔢 ID ордера: {order_info['id']}\n"
             f"👤 Пользователь: {order_info['user_id']}\n"
             f"💰 Исходная валюта: {order_info['currency']}\n"
-            f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-            f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-            f"💱Курс обмена: {order_info['exchange_rate']}\n"
+            f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+            f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+            f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
             f"🌐 Сеть: {order_info['network']}\n"
             f"💳 Номер карты: {order_info['bank_card']}\n"
             f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -786,16 +806,23 @@ async def cancel_order_warning_new(callback: CallbackQuery, state: FSMContext):
 
 
 @admin.callback_query(F.data.startswith("order_finished_"))
-async def finish_order_new(callback: CallbackQuery):
+async def finish_order_new(callback: CallbackQuery, session: AsyncSession):
     try:
         # Извлекаем ID ордера из callback_data
         order_id = int(callback.data.split('_')[-1])
 
-        # Update order status in database
-        await update_order_status(order_id, "Ордер завершен администратором✅")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        # Update order status in one conditional UPDATE, the user notification goes to outbox in the same transaction
+        order_info = await transition_order_status(
+            order_id, OrderStatus.COMPLETED,
+            notifications=[outbox_message(f"✅ Ваш ордер #{order_id} был успешно завершен администратором!",
+                                          dedupe_key=f"order:{order_id}:status:{OrderStatus.COMPLETED.value}")],
+            session=session
+        )
+        if not order_info:
+            # Ордер уже завершён или отменён, например другим администратором
+            await callback.answer("Ордер уже обработан", show_alert=True)
+            return
+        wake_outbox()
 
         if order_info:
             # Format updated message
@@ -804,9 +831,9 @@ async def finish_order_new(callback: CallbackQuery):
                 f"📋 Информация о заказе:\n"
                 f"🔢 ID ордера: {order_info['id']}\n"
                 f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-                f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+                f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты: {order_info['bank_card']}\n"
                 f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -837,15 +864,6 @@ async def finish_order_new(callback: CallbackQuery):
                     reply_markup=builder.as_markup()
                 )
 
-            # Notify user about order completion
-            try:
-                await callback.bot.send_message(
-                    order_info['user_id'],
-                    f"✅ Ваш ордер #{order_info['id']} был успешно завершен администратором!"
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify user about order completion: {e}")
-
         await callback.answer("Ордер успешно завершен!")
 
     except Exception as e:
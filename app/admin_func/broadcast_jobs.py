@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import NamedTuple
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from app.admin_func.broadcaster import Broadcaster, start_broadcast, MESSAGES_PER_SECOND
+from app.admin_keyboards import broadcast_job_keyboard
+from app.metrics import metrics
+from app.database.requests import (get_broadcast_job, set_broadcast_job_status, get_broadcast_jobs_by_status,
+                                   iter_pending_recipients, count_pending_recipients, save_broadcast_results,
+                                   get_due_broadcast_jobs, activate_scheduled_broadcast_job)
+
+# Сколько результатов доставки копить перед записью в БД
+RESULTS_BATCH_SIZE = 200
+
+# Не чаще трёх правок сообщения с прогрессом в минуту, чтобы не тратить лимит отправки
+PROGRESS_INTERVAL = 20
+
+# Как часто планировщик проверяет отложенные рассылки
+SCHEDULER_INTERVAL = 30
+
+# Нижняя граница скорости для рассылки, растянутой на окно времени
+MIN_SPREAD_RATE = 0.2
+
+class ActiveJob(NamedTuple):
+    task: asyncio.Task
+    # Ставится при паузе и отмене, чтобы остановить отправку сразу, а не после очередной страницы получателей
+    stop: asyncio.Event
+
+
+# Задания рассылки, которые выполняются в этом процессе
+active_jobs: dict[int, ActiveJob] = {}
+
+
+def build_buttons_markup(buttons: list) -> InlineKeyboardMarkup | None:
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=button["text"], url=button["url"]) for button in buttons]
+    ])
+
+
+def build_sender(job: dict):
+    """
+    Собирает функцию отправки сообщения рассылки одному получателю
+
+    В режиме копирования сообщение администратора пересылается через copyMessage
+    (альбом — через copyMessages): медиа не загружается заново, и каждый
+    получатель обходится одним запросом к API.
+    """
+    text = job["message_text"] or ""
+    photo = job["photo"]
+    markup = build_buttons_markup(job["buttons"])
+    source_chat_id = job["source_chat_id"]
+    source_message_ids = job["source_message_ids"]
+
+    if len(source_message_ids) > 1:
+        async def send(bot: Bot, chat_id: int):
+            await bot.copy_messages(chat_id, source_chat_id, source_message_ids)
+
+        return send
+
+    if source_message_ids:
+        async def send(bot: Bot, chat_id: int):
+            await bot.copy_message(chat_id, source_chat_id, source_message_ids[0], reply_markup=markup)
+
+        return send
+
+    async def send(bot: Bot, chat_id: int):
+        if photo:
+            await bot.send_photo(chat_id, photo, caption=text, reply_markup=markup)
+        else:
+            await bot.send_message(chat_id, text, reply_markup=markup)
+
+    return send
+
+
+class ResultBuffer:
+    """Копит результаты доставки и записывает их в БД пачками"""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.results = {"sent": [], "failed": [], "blocked": []}
+        self.size = 0
+        self.lock = asyncio.Lock()
+
+    async def add(self, chat_id: int, result: str):
+        self.results[result].append(chat_id)
+        self.size += 1
+        if self.size >= RESULTS_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            results = self.results
+            self.results = {"sent": [], "failed": [], "blocked": []}
+            self.size = 0
+            if not any(results.values()):
+                return
+            try:
+                await save_broadcast_results(self.job_id, results["sent"], results["failed"],
+                                             results["blocked"])
+            except Exception:
+                # Возвращаем результаты в буфер, чтобы следующий flush попробовал записать их снова
+                for status, ids in results.items():
+                    self.results[status].extend(ids)
+                    self.size += len(ids)
+                raise
+
+
+def format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}ч {minutes:02d}м" if hours else f"{minutes}м {seconds:02d}с"
+
+
+class ProgressReporter:
+    """Редактирует одно сообщение с прогрессом рассылки не чаще раза в PROGRESS_INTERVAL секунд"""
+
+    def __init__(self, bot: Bot, job: dict, broadcaster: Broadcaster, stop: asyncio.Event):
+        self.bot = bot
+        self.job = job
+        self.broadcaster = broadcaster
+        self.stop = stop
+        self.started_at = time.monotonic()
+
+    def counters(self) -> dict:
+        sent = self.job["success_count"] + self.broadcaster.success_count
+        failed = self.job["fail_count"] + self.broadcaster.fail_count
+        processed = self.broadcaster.success_count + self.broadcaster.fail_count
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "sent": sent,
+            "failed": failed,
+            "remaining": max(self.job["total_count"] - sent - failed, 0),
+            "throughput": processed / elapsed if elapsed > 0 else 0.0
+        }
+
+    def render(self) -> str:
+        counters = self.counters()
+        if counters["throughput"] > 0:
+            eta = format_eta(counters["remaining"] / counters["throughput"])
+        else:
+            eta = "—"
+        return (
+            f"Рассылка #{self.job['id']} выполняется.\n"
+            f"Отправлено: {counters['sent']}\n"
+            f"Ошибок: {counters['failed']}\n"
+            f"Осталось: {counters['remaining']}\n"
+            f"Скорость: {counters['throughput']:.1f} сообщ./с\n"
+            f"Осталось времени: {eta}"
+        )
+
+    def publish_metrics(self):
+        counters = self.counters()
+        metrics.set(f"broadcast_job_{self.job['id']}_remaining", counters["remaining"])
+        metrics.set(f"broadcast_job_{self.job['id']}_throughput", counters["throughput"])
+
+    async def run(self):
+        while True:
+            try:
+                # После паузы или отмены сообщение принадлежит обработчику кнопки, не перезаписываем его
+                await asyncio.wait_for(self.stop.wait(), PROGRESS_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            self.publish_metrics()
+            if not self.job["progress_message_id"]:
+                continue
+            try:
+                await self.bot.edit_message_text(
+                    text=self.render(),
+                    chat_id=self.job["admin_chat_id"],
+                    message_id=self.job["progress_message_id"],
+                    reply_markup=broadcast_job_keyboard(self.job["id"])
+                )
+            except Exception as e:
+                logging.error(f"Failed to update progress of broadcast job {self.job['id']}: {e}")
+
+
+async def run_job(bot: Bot, job_id: int, stop: asyncio.Event):
+    """
+    Выполняет задание рассылки с последней сохранённой точки
+
+    Отправка идёт только оставшимся получателям со статусом pending,
+    поэтому после перезапуска задание продолжается, а не начинается заново.
+    stop ставится кнопками паузы и отмены через stop_job.
+    """
+    try:
+        pending = None
+        while True:
+            # Сначала сбрасываем событие, потом читаем статус: пауза, нажатая после
+            # чтения, снова поставит событие и не потеряется
+            stop.clear()
+            job = await get_broadcast_job(job_id)
+            if not job or job["status"] != "running":
+                return
+
+            pending_before = await count_pending_recipients(job_id)
+            if pending is not None and pending_before >= pending:
+                # Прошлый проход не записал ни одного результата — повтор разослал бы тем же получателям
+                raise RuntimeError(f"Broadcast job {job_id} made no progress, {pending_before} recipients pending")
+            pending = pending_before
+
+            rate = MESSAGES_PER_SECOND
+            if job["spread_minutes"]:
+                # Растягиваем оставшуюся отправку на заданное окно, чтобы нагрузка была ровной
+                rate = min(MESSAGES_PER_SECOND, max(pending / (job["spread_minutes"] * 60), MIN_SPREAD_RATE))
+
+            buffer = ResultBuffer(job_id)
+            broadcaster = Broadcaster(bot, build_sender(job), iter_pending_recipients(job_id),
+                                      rate=rate, on_result=buffer.add, stop=stop)
+            reporter = asyncio.create_task(ProgressReporter(bot, job, broadcaster, stop).run())
+            try:
+                await broadcaster.run()
+            finally:
+                reporter.cancel()
+                await buffer.flush()
+
+            # Задание могли поставить на паузу и сразу продолжить, пока воркеры дорабатывали очередь:
+            # следующий проход перечитает статус
+            if stop.is_set():
+                pending = None
+                continue
+            if await count_pending_recipients(job_id) == 0:
+                break
+
+        if await set_broadcast_job_status(job_id, "finished", from_statuses=["running"]):
+            job = await get_broadcast_job(job_id)
+            summary = (f"Рассылка #{job_id} завершена.\n"
+                       f"Успешно отправлено: {job['success_count']}\n"
+                       f"Ошибок: {job['fail_count']}")
+            if job["progress_message_id"]:
+                try:
+                    await bot.edit_message_text(text=summary, chat_id=job["admin_chat_id"],
+                                                message_id=job["progress_message_id"], reply_markup=None)
+                except Exception as e:
+                    logging.error(f"Failed to update progress of broadcast job {job_id}: {e}")
+            await bot.send_message(job["admin_chat_id"], summary)
+    except Exception as e:
+        logging.error(f"Error in broadcast job {job_id}: {e}")
+        await pause_failed_job(bot, job_id)
+    finally:
+        active_jobs.pop(job_id, None)
+        metrics.set("broadcast_active_jobs", len(active_jobs))
+        metrics.discard(f"broadcast_job_{job_id}_remaining")
+        metrics.discard(f"broadcast_job_{job_id}_throughput")
+
+
+async def pause_failed_job(bot: Bot, job_id: int):
+    """Ставит задание на паузу после ошибки, чтобы администратор продолжил его вручную"""
+    if not await set_broadcast_job_status(job_id, "paused", from_statuses=["running"]):
+        return
+    job = await get_broadcast_job(job_id)
+    if job and job["progress_message_id"]:
+        try:
+            await bot.edit_message_text(
+                text=f"Рассылка #{job_id} приостановлена из-за ошибки.",
+                chat_id=job["admin_chat_id"],
+                message_id=job["progress_message_id"],
+                reply_markup=broadcast_job_keyboard(job_id, paused=True)
+            )
+        except Exception as e:
+            logging.error(f"Failed to update progress of broadcast job {job_id}: {e}")
+
+
+def launch_job(bot: Bot, job_id: int):
+    """
+    Запускает задание в фоне, если оно ещё не выполняется в этом процессе
+
+    Если задание ещё дорабатывает после паузы, новый запуск не нужен:
+    оно само перечитает статус и продолжит отправку.
+    """
+    if job_id not in active_jobs:
+        stop = asyncio.Event()
+        active_jobs[job_id] = ActiveJob(start_broadcast(run_job(bot, job_id, stop)), stop)
+        metrics.set("broadcast_active_jobs", len(active_jobs))
+
+
+def stop_job(job_id: int):
+    """Останавливает отправку задания в этом процессе после смены статуса на паузу или отмену"""
+    active_job = active_jobs.get(job_id)
+    if active_job:
+        active_job.stop.set()
+
+
+async def resume_broadcast_jobs(bot: Bot):
+    """Продолжает задания, прерванные перезапуском процесса"""
+    for job_id in await get_broadcast_jobs_by_status("running"):
+        logging.info(f"Resuming broadcast job {job_id}")
+        launch_job(bot, job_id)
+
+
+async def run_scheduler(bot: Bot):
+    """Запускает отложенные рассылки, когда подходит их время"""
+    while True:
+        try:
+            for job_id in await get_due_broadcast_jobs(datetime.now()):
+                if not await activate_scheduled_broadcast_job(job_id):
+                    continue
+                logging.info(f"Starting scheduled broadcast job {job_id}")
+                job = await get_broadcast_job(job_id)
+                if job["progress_message_id"]:
+                    try:
+                        await bot.edit_message_text(
+                            text=f"Рассылка #{job_id} запущена. Получателей: {job['total_count']}",
+                            chat_id=job["admin_chat_id"],
+                            message_id=job["progress_message_id"],
+                            reply_markup=broadcast_job_keyboard(job_id)
+                        )
+                    except Exception as e:
+                        logging.error(f"Failed to update progress of broadcast job {job_id}: {e}")
+                launch_job(bot, job_id)
+        except Exception as e:
+            logging.error(f"Error in broadcast scheduler: {e}")
+        await asyncio.sleep(SCHEDULER_INTERVAL)
+
+
+def start_scheduler(bot: Bot) -> asyncio.Task:
+    return start_broadcast(run_scheduler(bot))
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+
+from app.metrics import metrics
+from app.throttling import TokenBucket
+
+
+# Запас от глобального лимита бота остаётся на ответы пользователям и уведомления
+MESSAGES_PER_SECOND = 25
+WORKERS_COUNT = 10
+MAX_RETRIES = 3
+
+# Ссылки на фоновые рассылки, чтобы задачи не собрал сборщик мусора
+running_broadcasts: set[asyncio.Task] = set()
+
+
+class Broadcaster:
+    """
+    Рассылка пулом воркеров с общим ограничением скорости
+
+    Args:
+        bot: Экземпляр бота
+        send: Корутина send(bot, chat_id), отправляющая сообщение одному получателю
+        recipients: Список или асинхронный генератор tg_id получателей
+        workers: Количество одновременных воркеров
+        rate: Сообщений в секунду на всю рассылку
+        on_result: Необязательная корутина on_result(chat_id, result) для каждого получателя,
+            где result — "sent", "failed" или "blocked"
+        stop: Событие остановки: после него очередь больше не пополняется, а уже
+            взятые в очередь получатели пропускаются без отправки и без on_result
+    """
+
+    def __init__(self, bot: Bot, send, recipients, workers: int = WORKERS_COUNT,
+                 rate: float = MESSAGES_PER_SECOND, on_result=None, stop: asyncio.Event = None):
+        self.bot = bot
+        self.send = send
+        self.recipients = recipients
+        self.on_result = on_result
+        self.workers = workers
+        self.stop = stop or asyncio.Event()
+        self.error: Exception | None = None
+        self.bucket = TokenBucket(rate)
+        self.success_count = 0
+        self.fail_count = 0
+        self.blocked_count = 0
+
+    async def _deliver(self, chat_id: int) -> str | None:
+        for attempt in range(MAX_RETRIES):
+            await self.bucket.acquire()
+            if self.stop.is_set():
+                return None
+            try:
+                await self.send(self.bot, chat_id)
+                return "sent"
+            except TelegramRetryAfter as e:
+                logging.warning(f"RetryAfter {e.retry_after}s while sending to {chat_id}")
+                metrics.inc("broadcast_retry_after")
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                # Бот заблокирован или аккаунт удалён — повторять бессмысленно
+                logging.info(f"User {chat_id} is unreachable: {e}")
+                return "blocked"
+            except Exception as e:
+                logging.error(f"Failed to send message to {chat_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            chat_id = await queue.get()
+            try:
+                result = None if self.stop.is_set() else await self._deliver(chat_id)
+                if result is None:
+                    # Рассылку остановили: получатель остаётся pending
+                    continue
+                metrics.inc(f"broadcast_{result}")
+                if result == "sent":
+                    self.success_count += 1
+                else:
+                    self.fail_count += 1
+                    if result == "blocked":
+                        self.blocked_count += 1
+                if self.on_result:
+                    try:
+                        await self.on_result(chat_id, result)
+                    except Exception as e:
+                        # Результаты не сохраняются — дальше рассылать нельзя
+                        logging.error(f"Failed to record result for {chat_id}: {e}")
+                        self.error = self.error or e
+                        self.stop.set()
+            finally:
+                queue.task_done()
+
+    async def run(self) -> dict:
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            if hasattr(self.recipients, "__aiter__"):
+                async for chat_id in self.recipients:
+                    if self.stop.is_set():
+                        break
+                    await queue.put(chat_id)
+            else:
+                for chat_id in self.recipients:
+                    if self.stop.is_set():
+                        break
+                    await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if self.error:
+            raise self.error
+        return {"success": self.success_count, "fail": self.fail_count, "blocked": self.blocked_count}
+
+
+def start_broadcast(coro) -> asyncio.Task:
+    """Запускает рассылку в фоне, не блокируя обработчик"""
+    task = asyncio.create_task(coro)
+    running_broadcasts.add(task)
+    task.add_done_callback(running_broadcasts.discard)
+    return task
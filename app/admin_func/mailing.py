@@ -2,14 +2,25 @@ from aiogram import Router, F
 from aiogram.types import (Message, InputFile, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup,
                            InlineKeyboardButton, CallbackQuery)
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.states import Mailing
-from app.database.requests import get_all_users
-from app.admin_keyboards import admin_main_keyboard
+from app.database.requests import (create_broadcast_job, get_broadcast_job, set_broadcast_job_status,
+                                   set_broadcast_progress_message, count_segment_users, MAILING_SEGMENTS)
+from app.admin_keyboards import admin_main_keyboard, broadcast_job_keyboard
+from app.admin_func.broadcast_jobs import launch_job, stop_job
 
+import asyncio
 import logging
+from datetime import datetime
 
 mailing = Router()
 
+# Сколько ждать остальные сообщения альбома, присланного для рассылки
+ALBUM_COLLECT_DELAY = 1.0
+
+# Альбомы, которые ещё собираются: media_group_id -> id сообщений
+album_buffer: dict[str, list[int]] = {}
+
 
 async def save_current_state(state: FSMContext):
     data = await state.get_data()
@@ -26,6 +37,11 @@ back_exit_keyboard = ReplyKeyboardMarkup(
     one_time_keyboard=True
 )
 
+segment_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=title, callback_data=f"mailing_segment_{segment}")]
+    for segment, title in MAILING_SEGMENTS.items()
+])
+
 
 @mailing.message(F.text == "Выйти🚪")
 async def exit_mailing(message: Message, state: FSMContext):
@@ -34,7 +50,9 @@ async def exit_mailing(message: Message, state: FSMContext):
 
 
 async def start_mailing(message: Message, state: FSMContext):
-    await message.answer("Отправьте сообщение для рассылки или нажмите 'Пропустить'.", reply_markup=back_exit_keyboard)
+    await message.answer("Отправьте сообщение для рассылки или нажмите 'Пропустить'.\n"
+                         "Фото, видео, документ или альбом будут разосланы копией вашего сообщения.",
+                         reply_markup=back_exit_keyboard)
     await state.set_state(Mailing.waiting_for_message)
 
 
@@ -46,6 +64,33 @@ async def skip_message(message: Message, state: FSMContext):
     await state.set_state(Mailing.waiting_for_photo)
 
 
+@mailing.message(Mailing.waiting_for_message, ~F.text)
+async def process_copy_message(message: Message, state: FSMContext):
+    # Фото, видео, документ или альбом рассылаются копией исходного сообщения
+    if message.media_group_id:
+        group = album_buffer.setdefault(message.media_group_id, [])
+        group.append(message.message_id)
+        if len(group) > 1:
+            return
+        await asyncio.sleep(ALBUM_COLLECT_DELAY)
+        message_ids = sorted(album_buffer.pop(message.media_group_id))
+    else:
+        message_ids = [message.message_id]
+
+    await state.update_data(message_text="", photo=None,
+                            copy_from_chat_id=message.chat.id, copy_message_ids=message_ids)
+
+    if len(message_ids) > 1:
+        # К альбому нельзя прикрепить кнопки
+        await state.update_data(buttons=[])
+        await show_preview(message, state)
+        return
+
+    await message.answer("Теперь отправьте текст для кнопки или напишите 'Пропустить'.",
+                         reply_markup=back_exit_keyboard)
+    await state.set_state(Mailing.waiting_for_button_text)
+
+
 @mailing.message(Mailing.waiting_for_message)
 async def process_message(message: Message, state: FSMContext):
     await state.update_data(message_text=message.text)
@@ -98,8 +143,9 @@ async def show_preview(message: Message, state: FSMContext):
     text = data.get("message_text", "")
     photo = data.get("photo")
     buttons = data.get("buttons", [])
+    copy_message_ids = data.get("copy_message_ids")
 
-    if not text and not photo:
+    if not text and not photo and not copy_message_ids:
         await message.answer("Ошибка: рассылка должна содержать хотя бы текст или фото.",
                            reply_markup=admin_main_keyboard)
         await state.clear()
@@ -113,23 +159,19 @@ async def show_preview(message: Message, state: FSMContext):
         markup = None
 
     try:
-        if photo:
+        if copy_message_ids and len(copy_message_ids) > 1:
+            await message.bot.copy_messages(message.chat.id, data["copy_from_chat_id"], copy_message_ids)
+        elif copy_message_ids:
+            await message.bot.copy_message(message.chat.id, data["copy_from_chat_id"], copy_message_ids[0],
+                                           reply_markup=markup)
+        elif photo:
             await message.answer_photo(photo, caption=text, reply_markup=markup)
         else:
             await message.answer(text, reply_markup=markup)
 
-        confirm_cancel_keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_mailing"),
-                    InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_mailing")
-                ]
-            ]
-        )
-
-        await message.answer("Это предпоказ сообщения. Подтвердите отправку или отмените рассылку.",
-                           reply_markup=confirm_cancel_keyboard)
-        await state.set_state(Mailing.confirm_mailing)
+        await message.answer("Это предпоказ сообщения. Выберите, кому отправить рассылку.",
+                             reply_markup=segment_keyboard)
+        await state.set_state(Mailing.waiting_for_segment)
     except Exception as e:
         logging.error(f"Error in show_preview: {e}")
         await message.answer("Произошла ошибка при создании предпросмотра.",
@@ -137,39 +179,173 @@ async def show_preview(message: Message, state: FSMContext):
         await state.clear()
 
 
+@mailing.callback_query(Mailing.waiting_for_segment, F.data.startswith("mailing_segment_"))
+async def process_segment(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    segment = callback.data.removeprefix("mailing_segment_")
+    await callback.answer()
+    if segment not in MAILING_SEGMENTS:
+        return
+
+    await state.update_data(segment=segment, since=None)
+    if segment == "inactive":
+        await callback.message.answer("Отправьте дату в формате ДД.ММ.ГГГГ: рассылка уйдёт тем, "
+                                      "кто не создавал ордеров с этой даты.")
+        await state.set_state(Mailing.waiting_for_inactive_date)
+        return
+
+    await show_segment_confirmation(callback.message, state, session=session)
+
+
+@mailing.message(Mailing.waiting_for_inactive_date)
+async def process_inactive_date(message: Message, state: FSMContext, session: AsyncSession):
+    try:
+        since = datetime.strptime(message.text.strip(), "%d.%m.%Y")
+    except (ValueError, AttributeError):
+        await message.answer("Пожалуйста, введите дату в формате ДД.ММ.ГГГГ, например 01.09.2024.")
+        return
+
+    await state.update_data(since=since.isoformat())
+    await show_segment_confirmation(message, state, session=session)
+
+
+async def show_segment_confirmation(message: Message, state: FSMContext, session: AsyncSession = None):
+    data = await state.get_data()
+    segment = data.get("segment", "all")
+    since = datetime.fromisoformat(data["since"]) if data.get("since") else None
+    recipients_count = await count_segment_users(segment, since, session=session)
+
+    segment_title = MAILING_SEGMENTS[segment]
+    if since:
+        segment_title += f" {since.strftime('%d.%m.%Y')}"
+
+    confirm_cancel_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_mailing"),
+                InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_mailing")
+            ],
+            [InlineKeyboardButton(text="🕒 Запланировать", callback_data="schedule_mailing")]
+        ]
+    )
+
+    await message.answer(f"Сегмент: {segment_title}\nПолучателей: {recipients_count}\n\n"
+                         f"Подтвердите отправку или отмените рассылку.",
+                         reply_markup=confirm_cancel_keyboard)
+    await state.set_state(Mailing.confirm_mailing)
+
+
 @mailing.callback_query(Mailing.confirm_mailing, F.data == "confirm_mailing")
-async def confirm_mailing_callback(callback: CallbackQuery, state: FSMContext):
+async def confirm_mailing_callback(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await create_mailing_job(callback.message, state, session=session)
+    await callback.answer()
+
+
+@mailing.callback_query(Mailing.confirm_mailing, F.data == "schedule_mailing")
+async def schedule_mailing_callback(callback: CallbackQuery, state: FSMContext):
+    await callback.message.answer(
+        "Отправьте время запуска в формате ДД.ММ.ГГГГ ЧЧ:ММ.\n"
+        "Чтобы растянуть отправку, добавьте через пробел окно в минутах, например: 25.12.2024 10:00 60"
+    )
+    await state.set_state(Mailing.waiting_for_schedule)
+    await callback.answer()
+
+
+@mailing.message(Mailing.waiting_for_schedule)
+async def process_schedule(message: Message, state: FSMContext, session: AsyncSession):
+    parts = (message.text or "").split()
+    try:
+        scheduled_at = datetime.strptime(" ".join(parts[:2]), "%d.%m.%Y %H:%M")
+        spread_minutes = int(parts[2]) if len(parts) > 2 else None
+        if len(parts) > 3 or (spread_minutes is not None and spread_minutes <= 0):
+            raise ValueError
+    except ValueError:
+        await message.answer("Пожалуйста, введите время в формате ДД.ММ.ГГГГ ЧЧ:ММ и, при необходимости, "
+                             "окно в минутах.")
+        return
+
+    if scheduled_at <= datetime.now():
+        await message.answer("Время запуска должно быть в будущем.")
+        return
+
+    await create_mailing_job(message, state, scheduled_at, spread_minutes, session=session)
+
+
+async def create_mailing_job(message: Message, state: FSMContext, scheduled_at: datetime = None,
+                             spread_minutes: int = None, session: AsyncSession = None):
     data = await state.get_data()
     text = data.get("message_text", "")
     photo = data.get("photo")
     buttons = data.get("buttons", [])
+    segment = data.get("segment", "all")
+    since = datetime.fromisoformat(data["since"]) if data.get("since") else None
 
-    if buttons:
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=button["text"], url=button["url"]) for button in buttons]
-        ])
+    try:
+        job_id = await create_broadcast_job(message.chat.id, text, photo, buttons, segment, since,
+                                            source_chat_id=data.get("copy_from_chat_id"),
+                                            source_message_ids=data.get("copy_message_ids"),
+                                            scheduled_at=scheduled_at, spread_minutes=spread_minutes,
+                                            session=session)
+    except Exception as e:
+        logging.error(f"Error in create_mailing_job: {e}")
+        await message.answer("Не удалось создать рассылку.", reply_markup=admin_main_keyboard)
+        await state.clear()
+        return
+
+    if scheduled_at:
+        progress_message = await message.answer(
+            f"Рассылка #{job_id} запланирована на {scheduled_at.strftime('%d.%m.%Y %H:%M')}.",
+            reply_markup=broadcast_job_keyboard(job_id, scheduled=True)
+        )
     else:
-        markup = None
+        progress_message = await message.answer(f"Рассылка #{job_id} запущена.",
+                                                reply_markup=broadcast_job_keyboard(job_id))
+    await set_broadcast_progress_message(job_id, progress_message.message_id)
+    if not scheduled_at:
+        launch_job(message.bot, job_id)
 
-    success_count = 0
-    fail_count = 0
-    users = await get_all_users()
-
-    for user in users:
-        try:
-            if photo:
-                await callback.bot.send_photo(user.tg_id, photo, caption=text, reply_markup=markup)
-            else:
-                await callback.bot.send_message(user.tg_id, text, reply_markup=markup)
-            success_count += 1
-        except Exception as e:
-            logging.error(f"Failed to send message to {user.tg_id}: {e}")
-            fail_count += 1
-
-    status_message = f"Рассылка завершена.\nУспешно отправлено: {success_count}\nОшибок: {fail_count}"
-    await callback.message.answer(status_message, reply_markup=admin_main_keyboard)
+    await message.answer("Вы вернулись в главное меню.", reply_markup=admin_main_keyboard)
     await state.clear()
-    await callback.answer()
+
+
+@mailing.callback_query(F.data.startswith("broadcast_pause_"))
+async def pause_broadcast_callback(callback: CallbackQuery):
+    job_id = int(callback.data.split("_")[-1])
+    if await set_broadcast_job_status(job_id, "paused", from_statuses=["running"]):
+        stop_job(job_id)
+        await callback.message.edit_text(f"Рассылка #{job_id} на паузе.",
+                                         reply_markup=broadcast_job_keyboard(job_id, paused=True))
+        await callback.answer("Рассылка приостановлена")
+    else:
+        await callback.answer("Рассылка уже не выполняется")
+
+
+@mailing.callback_query(F.data.startswith("broadcast_resume_"))
+async def resume_broadcast_callback(callback: CallbackQuery):
+    job_id = int(callback.data.split("_")[-1])
+    if await set_broadcast_job_status(job_id, "running", from_statuses=["paused"]):
+        launch_job(callback.bot, job_id)
+        await callback.message.edit_text(f"Рассылка #{job_id} продолжена.",
+                                         reply_markup=broadcast_job_keyboard(job_id))
+        await callback.answer("Рассылка продолжена")
+    else:
+        await callback.answer("Рассылка не на паузе")
+
+
+@mailing.callback_query(F.data.startswith("broadcast_cancel_"))
+async def cancel_broadcast_callback(callback: CallbackQuery):
+    job_id = int(callback.data.split("_")[-1])
+    if await set_broadcast_job_status(job_id, "canceled", from_statuses=["scheduled", "running", "paused"]):
+        stop_job(job_id)
+        job = await get_broadcast_job(job_id)
+        await callback.message.edit_text(
+            f"Рассылка #{job_id} остановлена.\n"
+            f"Успешно отправлено: {job['success_count']}\n"
+            f"Ошибок: {job['fail_count']}",
+            reply_markup=None
+        )
+        await callback.answer("Рассылка остановлена")
+    else:
+        await callback.answer("Рассылка уже завершена")
 
 
 @mailing.callback_query(F.data == "cancel_mailing")
@@ -191,7 +367,9 @@ async def go_back(message: Message, state: FSMContext):
             Mailing.waiting_for_message: "Отправьте сообщение для рассылки или нажмите 'Пропустить'.",
             Mailing.waiting_for_photo: "Отправьте фото для рассылки или напишите 'Пропустить'.",
             Mailing.waiting_for_button_text: "Отправьте текст для кнопки или напишите 'Пропустить'.",
-            Mailing.waiting_for_button_url: "Отправьте URL для кнопки."
+            Mailing.waiting_for_button_url: "Отправьте URL для кнопки.",
+            Mailing.waiting_for_inactive_date: "Отправьте дату в формате ДД.ММ.ГГГГ.",
+            Mailing.waiting_for_schedule: "Отправьте время запуска в формате ДД.ММ.ГГГГ ЧЧ:ММ."
         }.get(previous_state, "Вернулись к предыдущему шагу.")
 
         await message.answer(current_step_message, reply_markup=back_exit_keyboard)
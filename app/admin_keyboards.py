@@ -1,9 +1,12 @@
 from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton,
                            InlineKeyboardMarkup, InlineKeyboardButton)
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.requests import get_orders_page_with_total, get_orders_page_with_total_for_user
+from app.user_keyboard import order_list_pagination_buttons
 
 import logging
+from app.order_status import status_text
 from config import ADMIN
 
 admin_main_keyboard = ReplyKeyboardMarkup(keyboard=[
@@ -62,24 +65,40 @@ order_info_menu = InlineKeyboardMarkup(inline_keyboard=[
 ])
 
 
+# Управление заданием рассылки
+def broadcast_job_keyboard(job_id: int, paused: bool = False, scheduled: bool = False) -> InlineKeyboardMarkup:
+    cancel = InlineKeyboardButton(text="⛔️ Остановить", callback_data=f"broadcast_cancel_{job_id}")
+    if scheduled:
+        return InlineKeyboardMarkup(inline_keyboard=[[cancel]])
+    if paused:
+        toggle = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"broadcast_resume_{job_id}")
+    else:
+        toggle = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"broadcast_pause_{job_id}")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, cancel]
+    ])
+
+
 # Билдер для клавиатуры с инфой об ордерах
 def format_order_button_text(order) -> str:
     """Форматирует текст для кнопки ордера"""
-    return f"ID: {order.id} | {order.currency} | {order.status}"
+    return f"ID: {order.id} | {order.currency} | {status_text(order.status)}"
 
 
 # В файле admin_keyboards.py
-async def admin_build_orders_keyboard(page: int = 1, user_id: int = None) -> InlineKeyboardMarkup | None:
+async def admin_build_orders_keyboard(page: int = 1, user_id: int = None, direction: str = "next",
+                                      cursor: str = None,
+                                      session: AsyncSession = None) -> InlineKeyboardMarkup | None:
     try:
         # Список администраторов
         ADMINS = [7185429091]
 
         # Если пользователь — администратор, показываем все ордера
         if user_id in ADMINS:
-            result = await get_orders_page_with_total(page)
+            result = await get_orders_page_with_total(cursor, direction, session=session)
             logging.info(f"Admin {user_id} fetching all orders for page {page}")
         else:
-            result = await get_orders_page_with_total_for_user(user_id, page)
+            result = await get_orders_page_with_total_for_user(user_id, cursor, direction, session=session)
             logging.info(f"User {user_id} fetching own orders for page {page}")
 
         orders = result["orders"]
@@ -103,19 +122,10 @@ async def admin_build_orders_keyboard(page: int = 1, user_id: int = None) -> Inl
                 ))
             builder.adjust(1)
 
-        pagination_buttons = []
-        if page > 1:
-            pagination_buttons.append(InlineKeyboardButton(
-                text="←", callback_data=f"order_list_{page - 1}"
-            ))
-        pagination_buttons.append(InlineKeyboardButton(
-            text=f"{page}/{total_pages}", callback_data="current_page"
-        ))
-        if page < total_pages:
-            pagination_buttons.append(InlineKeyboardButton(
-                text="→", callback_data=f"order_list_{page + 1}"
-            ))
-        builder.row(*pagination_buttons)
+        if orders:
+            builder.row(*order_list_pagination_buttons("order_list_", page, result))
+        else:
+            builder.row(InlineKeyboardButton(text="« В начало", callback_data="order_list"))
 
         return builder.as_markup()
     except Exception as e:
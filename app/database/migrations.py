@@ -0,0 +1,265 @@
+import logging
+
+from sqlalchemy import inspect, select, update, text, func, case, table, column, cast, Numeric, BigInteger
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database.models import User, Order, Rate, SchemaVersion
+from app.money import USDT_PLACES, RATE_PLACES
+from app.order_status import LEGACY_STATUS_CODES
+
+
+# Размер пачки id при заполнении новых колонок ордеров
+BACKFILL_BATCH = 1000
+
+
+async def has_table(conn, table_name: str) -> bool:
+    return await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(table_name))
+
+
+async def get_columns(conn, table_name: str) -> set:
+    return await conn.run_sync(lambda sync_conn: {info["name"] for info in inspect(sync_conn).get_columns(table_name)})
+
+
+async def add_column(conn, column):
+    """Добавляет в существующую таблицу колонку из модели, если её ещё нет"""
+    table_name = column.table.name
+    if column.name in await get_columns(conn, table_name):
+        return
+
+    dialect = conn.dialect
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        if not isinstance(default, str):
+            default = default.compile(dialect=dialect)
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    await conn.execute(text(ddl))
+    logging.info(f"Added column {table_name}.{column.name}")
+
+
+async def execute_online(engine: AsyncEngine, ddl: str):
+    """
+    Выполняет DDL для индекса
+
+    В PostgreSQL индекс строится и удаляется CONCURRENTLY вне транзакции,
+    чтобы не блокировать запись в таблицу на время операции.
+    """
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)))
+    else:
+        async with engine.begin() as conn:
+            await conn.execute(text(ddl))
+
+
+async def create_index_online(engine: AsyncEngine, name: str, table_name: str, columns: tuple,
+                              unique: bool = False):
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    await execute_online(engine, f"CREATE {kind} IF NOT EXISTS {name} ON {table_name} ({', '.join(columns)})")
+    logging.info(f"Index {name} is ready")
+
+
+async def drop_index_online(engine: AsyncEngine, name: str):
+    await execute_online(engine, f"DROP INDEX IF EXISTS {name}")
+    logging.info(f"Index {name} is dropped")
+
+
+async def add_user_blocked_columns(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await add_column(conn, User.__table__.c.is_blocked)
+        await add_column(conn, User.__table__.c.blocked_at)
+
+
+# Индексы на момент миграции 2, дальнейшие изменения индексов — отдельными миграциями
+LOOKUP_INDEXES = [
+    ("ix_orders_user_id_date_created", "orders", ("user_id", "date_created", "id")),
+    ("ix_orders_date_created_id", "orders", ("date_created", "id")),
+    ("ix_orders_status_date_payment", "orders", ("status", "date_payment")),
+    ("ix_orders_wallet_status", "orders", ("wallet", "status")),
+    ("ix_wallets_network", "wallets", ("network",)),
+    ("ix_wallets_address", "wallets", ("address",)),
+    ("ix_users_is_blocked", "users", ("is_blocked",)),
+]
+
+
+async def create_lookup_indexes(engine: AsyncEngine):
+    for name, table_name, columns in LOOKUP_INDEXES:
+        await create_index_online(engine, name, table_name, columns)
+
+
+async def convert_order_statuses(engine: AsyncEngine):
+    """
+    Переводит статусы ордеров из строк в коды OrderStatus
+
+    Коды заполняются пачками по диапазонам id, каждая пачка в своей
+    транзакции, чтобы не держать блокировку на всей таблице.
+    Старая колонка status остаётся в таблице, но больше не используется.
+    """
+    async with engine.begin() as conn:
+        await add_column(conn, Order.__table__.c.status_code)
+        columns = await get_columns(conn, "orders")
+        max_id = await conn.scalar(select(func.max(Order.id)))
+
+    if "status" in columns and max_id:
+        legacy = table("orders", column("id"), column("status"), column("status_code"))
+        code = case({text_value: int(code) for text_value, code in LEGACY_STATUS_CODES.items()},
+                    value=legacy.c.status)
+        for start in range(0, max_id, BACKFILL_BATCH):
+            async with engine.begin() as conn:
+                await conn.execute(
+                    update(legacy)
+                    .where(legacy.c.id > start,
+                           legacy.c.id <= start + BACKFILL_BATCH,
+                           legacy.c.status_code.is_(None))
+                    .values(status_code=code)
+                )
+
+        async with engine.begin() as conn:
+            unknown = await conn.scalar(
+                select(func.count()).select_from(legacy)
+                .where(legacy.c.status_code.is_(None), legacy.c.status.is_not(None))
+            )
+        if unknown:
+            logging.warning(f"{unknown} orders have unknown legacy status and no status code")
+
+    await drop_index_online(engine, "ix_orders_status_date_payment")
+    await drop_index_online(engine, "ix_orders_wallet_status")
+    await create_index_online(engine, "ix_orders_status_code_date_payment", "orders", ("status_code", "date_payment"))
+    await create_index_online(engine, "ix_orders_wallet_status_code", "orders", ("wallet", "status_code"))
+
+
+def to_minor_units(legacy_column, places: int):
+    """SQL-выражение: строка или float из старой колонки в целые минимальные единицы"""
+    return cast(func.round(cast(legacy_column, Numeric) * 10 ** places), BigInteger)
+
+
+async def convert_money_columns(engine: AsyncEngine):
+    """
+    Переводит суммы и курсы из строк и float в целые минимальные единицы
+
+    Ордера заполняются пачками по диапазонам id, как в convert_order_statuses.
+    Старые колонки value, exchange_rate и rate_value остаются, но не используются.
+    """
+    async with engine.begin() as conn:
+        await add_column(conn, Order.__table__.c.value_minor)
+        await add_column(conn, Order.__table__.c.exchange_rate_minor)
+        await add_column(conn, Rate.__table__.c.rate_minor)
+        order_columns = await get_columns(conn, "orders")
+        rate_columns = await get_columns(conn, "rates")
+        max_id = await conn.scalar(select(func.max(Order.id)))
+
+    if {"value", "exchange_rate"} <= order_columns and max_id:
+        legacy = table("orders", column("id"), column("value"), column("exchange_rate"),
+                       column("value_minor"), column("exchange_rate_minor"))
+        for start in range(0, max_id, BACKFILL_BATCH):
+            async with engine.begin() as conn:
+                await conn.execute(
+                    update(legacy)
+                    .where(legacy.c.id > start,
+                           legacy.c.id <= start + BACKFILL_BATCH,
+                           legacy.c.value_minor.is_(None))
+                    .values(value_minor=to_minor_units(legacy.c.value, USDT_PLACES),
+                            exchange_rate_minor=to_minor_units(legacy.c.exchange_rate, RATE_PLACES))
+                )
+
+    if "rate_value" in rate_columns:
+        legacy = table("rates", column("rate_value"), column("rate_minor"))
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(legacy)
+                .where(legacy.c.rate_minor.is_(None))
+                .values(rate_minor=to_minor_units(legacy.c.rate_value, RATE_PLACES))
+            )
+
+
+async def add_profile_complete_flag(engine: AsyncEngine):
+    """Добавляет users.profile_complete и отмечает уже заполненные профили"""
+    async with engine.begin() as conn:
+        await add_column(conn, User.__table__.c.profile_complete)
+        await conn.execute(
+            update(User)
+            .where(User.phone_number.is_not(None), User.phone_number != '',
+                   User.nickname.is_not(None), User.nickname != '',
+                   User.bank_card.is_not(None))
+            .values(profile_complete=True)
+        )
+
+
+async def add_order_idempotency_key(engine: AsyncEngine):
+    """Добавляет orders.idempotency_key с уникальным индексом, у старых ордеров ключ пустой"""
+    async with engine.begin() as conn:
+        await add_column(conn, Order.__table__.c.idempotency_key)
+    await create_index_online(engine, "ix_orders_idempotency_key", "orders", ("idempotency_key",), unique=True)
+
+
+async def normalize_order_dates(engine: AsyncEngine):
+    """
+    Приводит orders.date_created в SQLite к формату SQLAlchemy DateTime
+
+    server_default CURRENT_TIMESTAMP записывает 'YYYY-MM-DD HH:MM:SS', а курсор
+    пагинации передаётся с микросекундами. SQLite сравнивает их как строки,
+    поэтому старым строкам дописывается '.000000'. В PostgreSQL это настоящий
+    timestamp, миграция ничего не делает.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    async with engine.begin() as conn:
+        max_id = await conn.scalar(select(func.max(Order.id)))
+    if not max_id:
+        return
+
+    legacy = table("orders", column("id"), column("date_created"))
+    for start in range(0, max_id, BACKFILL_BATCH):
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(legacy)
+                .where(legacy.c.id > start,
+                       legacy.c.id <= start + BACKFILL_BATCH,
+                       func.length(legacy.c.date_created) == 19)
+                .values(date_created=legacy.c.date_created.concat(".000000"))
+            )
+
+
+# Миграции по порядку: (версия, описание, корутина migration(engine))
+MIGRATIONS = [
+    (1, "users: флаг блокировки бота", add_user_blocked_columns),
+    (2, "индексы ордеров, кошельков и пользователей", create_lookup_indexes),
+    (3, "orders: коды статусов вместо строк", convert_order_statuses),
+    (4, "orders, rates: суммы и курс в минимальных единицах", convert_money_columns),
+    (5, "users: флаг заполненного профиля", add_profile_complete_flag),
+    (6, "orders: ключ идемпотентности подтверждения", add_order_idempotency_key),
+    (7, "orders: формат date_created в SQLite для пагинации", normalize_order_dates),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def run_migrations(engine: AsyncEngine, fresh: bool = False):
+    """
+    Применяет миграции, которых ещё нет в schema_version
+
+    Версия записывается после каждой миграции, поэтому при следующем
+    запуске уже выполненные шаги пропускаются без обращения к схеме.
+    Новая база создаётся create_all сразу в актуальном виде (fresh=True)
+    и получает последнюю версию без выполнения миграций.
+    """
+    async with engine.begin() as conn:
+        version = await conn.scalar(select(SchemaVersion.version).where(SchemaVersion.id == 1))
+        if version is None:
+            version = LATEST_VERSION if fresh else 0
+            await conn.execute(SchemaVersion.__table__.insert().values(id=1, version=version))
+
+    for migration_version, description, migration in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        logging.info(f"Applying migration {migration_version}: {description}")
+        await migration(engine)
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(SchemaVersion).where(SchemaVersion.id == 1).values(version=migration_version)
+            )
+        version = migration_version
@@ -1,11 +1,14 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
+from decimal import Decimal
 
-from sqlalchemy import ForeignKey, String, BigInteger, Integer, Boolean, Float
+from sqlalchemy import ForeignKey, String, BigInteger, Integer, SmallInteger, Boolean, JSON, Index
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy import DateTime
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, false
 
+from app.money import Money, USDT_PLACES, RATE_PLACES
 from config import DB_URL
 
 engine = create_async_engine(url=DB_URL,
@@ -14,6 +17,21 @@ engine = create_async_engine(url=DB_URL,
 async_session = async_sessionmaker(engine)
 
 
+@asynccontextmanager
+async def session_scope(session: AsyncSession = None):
+    """
+    Сессия для функций из app.database.requests
+
+    Если передана сессия обновления из DbSessionMiddleware, используется она,
+    иначе открывается отдельная сессия (фоновые задачи, запуск бота).
+    """
+    if session is not None:
+        yield session
+    else:
+        async with async_session() as new_session:
+            yield new_session
+
+
 class Base(AsyncAttrs, DeclarativeBase):
     pass
 
@@ -27,6 +45,13 @@ class User(Base):
     phone_number: Mapped[str] = mapped_column(String, nullable=True)
     nickname: Mapped[str] = mapped_column(String, nullable=True)
     bank_card: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Пользователь заблокировал бота или удалил аккаунт — в рассылки не попадает
+    is_blocked: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False,
+                                             server_default=false(), index=True)
+    blocked_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Телефон, никнейм и карта заполнены — ставится при завершении регистрации
+    profile_complete: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False,
+                                                   server_default=false())
 
     # Связи с заметками и напоминаниями
     orders: Mapped[list["Order"]] = relationship("Order", back_populates="user", cascade="all, delete-orphan")
@@ -38,33 +63,50 @@ class Order(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.tg_id'), nullable=False)
     currency: Mapped[str] = mapped_column(String, nullable=False)
-    value: Mapped[str] = mapped_column(String, nullable=True)
-    exchange_rate: Mapped[float] = mapped_column(Float, nullable=True) # Курс по которому создан ордер
+    # Суммы хранятся в минимальных единицах, см. app.money.Money
+    value: Mapped[Decimal] = mapped_column('value_minor', Money(USDT_PLACES), nullable=True)
+    exchange_rate: Mapped[Decimal] = mapped_column('exchange_rate_minor', Money(RATE_PLACES), nullable=True) # Курс по которому создан ордер
     network: Mapped[str] = mapped_column(String, nullable=True)
     bank_card: Mapped[int] = mapped_column(BigInteger, nullable=False)
     wallet: Mapped[str] = mapped_column(String, nullable=True)
-    status: Mapped[str] = mapped_column(String, nullable=True)
+    # Код из app.order_status.OrderStatus, текст статуса хранится в реестре
+    status: Mapped[int] = mapped_column('status_code', SmallInteger, nullable=True)
     file_id: Mapped[str] = mapped_column(String, nullable=True)
-    date_created: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
+    # Время задаётся в Python, чтобы в SQLite оно хранилось в том же формате,
+    # что и курсор пагинации (date_created, id) при сравнении
+    date_created: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, server_default=func.now(),
+                                                   nullable=False)
     user: Mapped["User"] = relationship("User", back_populates="orders")
     date_payment: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     date_canceled: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     date_finished: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # Ключ подтверждения из FSM, повторное подтверждение находит уже созданный ордер
+    idempotency_key: Mapped[str] = mapped_column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Списки ордеров пользователя и общий список, пагинация по (date_created, id)
+        Index('ix_orders_user_id_date_created', 'user_id', 'date_created', 'id'),
+        Index('ix_orders_date_created_id', 'date_created', 'id'),
+        # Фильтры по статусу и открытые ордера по кошелькам
+        Index('ix_orders_status_code_date_payment', 'status_code', 'date_payment'),
+        Index('ix_orders_wallet_status_code', 'wallet', 'status_code'),
+        Index('ix_orders_idempotency_key', 'idempotency_key', unique=True),
+    )
 
 
 class Wallet(Base):
     __tablename__ = 'wallets'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    network: Mapped[str] = mapped_column(String, nullable=True)  # Тут записана сеть
-    address: Mapped[str] = mapped_column(String, nullable=True)  # Тут записаны кошельки
+    network: Mapped[str] = mapped_column(String, nullable=True, index=True)  # Тут записана сеть
+    address: Mapped[str] = mapped_column(String, nullable=True, index=True)  # Тут записаны кошельки
 
 
 class Rate(Base):
     __tablename__ = 'rates'
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)  # Фиксированный ID
-    rate_value: Mapped[float] = mapped_column(Float, nullable=True)  # Курс, который будет меняться
+    rate_value: Mapped[Decimal] = mapped_column('rate_minor', Money(RATE_PLACES), nullable=True)  # Курс, который будет меняться
 
 
 class Support(Base):
@@ -74,6 +116,86 @@ class Support(Base):
     support_value: Mapped[str] = mapped_column(String, nullable=True)  # Тут записан контакт поддержки
 
 
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)  # Фиксированный ID
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # Последняя применённая миграция
+
+
+class SettingsVersion(Base):
+    __tablename__ = 'settings_version'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)  # Фиксированный ID
+    # Растёт при каждом изменении курса, контакта поддержки или кошельков
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class BroadcastJob(Base):
+    __tablename__ = 'broadcast_jobs'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Кому отчитываться о рассылке
+    progress_message_id: Mapped[int] = mapped_column(BigInteger, nullable=True)  # Сообщение с прогрессом
+    message_text: Mapped[str] = mapped_column(String, nullable=True)
+    photo: Mapped[str] = mapped_column(String, nullable=True)
+    buttons: Mapped[list] = mapped_column(JSON, nullable=True)
+    # Режим копирования: исходное сообщение (или альбом) администратора
+    source_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    source_message_ids: Mapped[list] = mapped_column(JSON, nullable=True)
+    segment: Mapped[str] = mapped_column(String, nullable=False, default='all')  # Сегмент получателей
+    segment_since: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    # scheduled/running/paused/canceled/finished
+    status: Mapped[str] = mapped_column(String, nullable=False, default='running', index=True)
+    scheduled_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)  # Время отложенного запуска
+    spread_minutes: Mapped[int] = mapped_column(Integer, nullable=True)  # Растянуть отправку на N минут
+    total_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    success_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    fail_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    date_created: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
+    date_finished: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+class BroadcastRecipient(Base):
+    __tablename__ = 'broadcast_recipients'
+
+    job_id: Mapped[int] = mapped_column(ForeignKey('broadcast_jobs.id', ondelete='CASCADE'), primary_key=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    status: Mapped[str] = mapped_column(String, nullable=False, default='pending')  # pending/sent/failed/blocked
+
+
+class OutboxMessage(Base):
+    """Уведомление, записанное в одной транзакции с изменением ордера и ожидающее отправки"""
+    __tablename__ = 'outbox'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    text: Mapped[str] = mapped_column(String, nullable=True)  # Текст или подпись к фото
+    photo: Mapped[str] = mapped_column(String, nullable=True)  # file_id фото
+    reply_markup: Mapped[dict] = mapped_column(JSON, nullable=True)
+    # Повторная запись того же уведомления пропускается
+    dedupe_key: Mapped[str] = mapped_column(String, nullable=True, unique=True)
+    status: Mapped[str] = mapped_column(String, nullable=False, default='pending')  # pending/sent/failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Время в UTC из Python: воркер сравнивает его с datetime.utcnow(), а now() в базе может быть локальным
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, server_default=func.now(),
+                                                      nullable=False)
+    last_error: Mapped[str] = mapped_column(String, nullable=True)
+    date_created: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
+    date_sent: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Выборка очередной пачки воркером доставки
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+
 async def async_main():
+    from app.database.migrations import run_migrations, has_table
+
     async with engine.begin() as conn:
+        fresh = not await has_table(conn, Order.__tablename__)
         await conn.run_sync(Base.metadata.create_all)
+
+    # create_all не меняет существующие таблицы, это делают миграции
+    await run_migrations(engine, fresh=fresh)
@@ -1,51 +1,127 @@
+import time
 import random
+import asyncio
 import logging
-from app.database.models import async_session
-from app.database.models import User, Order, Rate, Support, Wallet
-from sqlalchemy import select, update, delete, desc, func
-from typing import List, Optional, Dict, Any
+from app.database.models import async_session, session_scope, engine
+from app.database.models import (User, Order, Rate, Support, Wallet, SettingsVersion, BroadcastJob,
+                                 BroadcastRecipient, OutboxMessage)
+from sqlalchemy import select, update, delete, desc, func, insert, literal, literal_column, false, tuple_, JSON, DateTime
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import List, Optional, Dict, Any, NamedTuple, Callable
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 
+from app.cache import TTLCache
+from app.order_status import OrderStatus, FINAL_STATUSES, TRANSITIONS, status_text
 
-async def set_user(tg_id, username=None, full_name=None):
-    async with async_session() as session:
+
+# Начало отсчёта для курсоров пагинации ордеров
+EPOCH = datetime(1970, 1, 1)
+
+# Количество ордеров: всего (ключ None) и по пользователям, сбрасывается при создании ордера
+order_totals_cache = TTLCache(maxsize=10000, ttl=60)
+
+# Заполненность профиля по tg_id, сбрасывается при любом изменении профиля
+profile_complete_cache = TTLCache(maxsize=50000, ttl=600)
+
+
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей базы"""
+    if engine.dialect.name == "postgresql":
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+
+async def upsert_user(session: AsyncSession, values: Dict[str, Any], update_values: Dict[str, Any]) -> bool:
+    """
+    Вставляет пользователя или обновляет поля существующего без предварительного SELECT
+
+    В PostgreSQL это один INSERT ... ON CONFLICT DO UPDATE, а новая строка
+    определяется по xmax = 0. SQLite не отличает вставку от обновления в RETURNING,
+    поэтому там INSERT ... ON CONFLICT DO NOTHING RETURNING и UPDATE, только если
+    строка уже была. Гонка двух одновременных /start в обоих случаях невозможна.
+
+    Returns:
+        bool: True, если пользователь только что создан
+    """
+    if engine.dialect.name == "postgresql":
+        statement = dialect_insert(User).values(**values)
+        statement = statement.on_conflict_do_update(index_elements=[User.tg_id], set_=update_values)
+        return bool(await session.scalar(statement.returning(literal_column("xmax = 0"))))
+
+    statement = dialect_insert(User).values(**values).on_conflict_do_nothing(index_elements=[User.tg_id])
+    if await session.scalar(statement.returning(User.tg_id)) is not None:
+        return True
+    if update_values:
+        await session.execute(update(User).where(User.tg_id == values["tg_id"]).values(**update_values))
+    return False
+
+
+async def set_user(tg_id, username=None, full_name=None, session: AsyncSession = None) -> Optional[bool]:
+    """
+    Регистрирует пользователя или обновляет имя существующего
+
+    Вернувшийся после блокировки бота пользователь снова получает рассылки.
+
+    Returns:
+        bool | None: True — пользователь создан, False — уже был, None — ошибка
+    """
+    async with session_scope(session) as session:
         try:
-            user = await session.scalar(select(User).where(User.tg_id == tg_id))
-            if user:
-                return True
-            else:
-                new_user = User(tg_id=tg_id, username=username, full_name=full_name)
-                session.add(new_user)
-                await session.commit()
+            created = await upsert_user(
+                session,
+                {"tg_id": tg_id, "username": username, "full_name": full_name},
+                {"username": username, "full_name": full_name, "is_blocked": False, "blocked_at": None}
+            )
+            await session.commit()
+            if created:
                 logging.info(f"Пользователь {tg_id} успешно добавлен")
-                return False
+            return created
         except Exception as e:
             logging.error(f"Ошибка при сохранении пользователя {tg_id}: {e}")
             await session.rollback()
-            return False
+            return None
 
 
-# Функция для обновления данных пользователя
-async def update_user_data(tg_id, field, value):
-    async with async_session() as session:
+async def save_registration(tg_id, phone_number, nickname, bank_card, username=None, full_name=None,
+                            session: AsyncSession = None) -> bool:
+    """
+    Сохраняет профиль, собранный в FSM за всю регистрацию, одним upsert
+
+    Returns:
+        bool: True, если профиль сохранён
+    """
+    fields = {
+        "phone_number": phone_number,
+        "nickname": nickname,
+        "bank_card": bank_card,
+        "profile_complete": True,
+        "is_blocked": False,
+        "blocked_at": None,
+    }
+    if username is not None:
+        fields["username"] = username
+    if full_name is not None:
+        fields["full_name"] = full_name
+
+    async with session_scope(session) as session:
         try:
-            user = await session.scalar(select(User).where(User.tg_id == tg_id))
-            if not user:
-                await set_user(tg_id)  # Создаём пользователя, если его нет
-            await session.execute(
-                update(User).where(User.tg_id == tg_id).values({field: value})
-            )
+            await upsert_user(session, {"tg_id": tg_id, **fields}, fields)
             await session.commit()
-            logging.info(f"Поле {field} обновлено для tg_id={tg_id}")
+            profile_complete_cache.set(tg_id, True)
+            return True
         except Exception as e:
-            logging.error(f"Ошибка при обновлении данных пользователя {tg_id}: {e}")
+            logging.error(f"Ошибка при сохранении регистрации пользователя {tg_id}: {e}")
             await session.rollback()
+            return False
 
 
-async def get_user_info(tg_id):
-    async with async_session() as session:
+async def get_user_info(tg_id, session: AsyncSession = None):
+    async with session_scope(session) as session:
         user = await session.scalar(select(User).where(User.tg_id == tg_id))
         if user:
             return {
@@ -60,48 +136,160 @@ async def get_user_info(tg_id):
 
 
 # Изменение никнейма в профиле
-async def update_nickname(tg_id, new_nickname):
-    async with async_session() as session:
+async def update_nickname(tg_id, new_nickname, session: AsyncSession = None):
+    async with session_scope(session) as session:
         user = await session.scalar(select(User).where(User.tg_id == tg_id))
         if user:
             user.nickname = new_nickname
             await session.commit()
+        profile_complete_cache.pop(tg_id)
 
 
 # Изменение банковской карты в профиле
-async def update_bank_card(tg_id, new_bank_card):
-    async with async_session() as session:
+async def update_bank_card(tg_id, new_bank_card, session: AsyncSession = None):
+    async with session_scope(session) as session:
         user = await session.scalar(select(User).where(User.tg_id == tg_id))
         if user:
             user.bank_card = new_bank_card
             await session.commit()
+        profile_complete_cache.pop(tg_id)
 
 
-# Функция для получения всех кошельков из таблицы Wallets
-async def get_wallets():
-    async with async_session() as session:
-        result = await session.execute(select(Wallet))
-        wallets = result.scalars().all()  # Получаем все кошельки
-        return wallets
+# Кошелек в снимке настроек
+class WalletInfo(NamedTuple):
+    id: int
+    network: str
+    address: str
 
 
-# Функция для получения текущего значения курса из таблицы Rate
-async def get_rate():
+class SettingsSnapshot(NamedTuple):
+    """Неизменяемый снимок настроек бота: курс, контакт поддержки и кошельки"""
+    version: int
+    rate: Optional[Decimal]
+    support_contact: Optional[str]
+    wallets: tuple
+    wallets_by_network: Dict[str, tuple]
+
+
+# Как часто сверять версию настроек с БД, чтобы увидеть изменения из других процессов
+SETTINGS_VERSION_CHECK_INTERVAL = 5
+
+settings_snapshot: Optional[SettingsSnapshot] = None
+settings_checked_at = 0.0
+settings_lock = asyncio.Lock()
+
+
+async def bump_settings_version(session):
+    """Увеличивает версию настроек в той же транзакции, что и изменение"""
+    result = await session.execute(
+        update(SettingsVersion).where(SettingsVersion.id == 1).values(version=SettingsVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.add(SettingsVersion(id=1, version=1))
+
+
+async def reload_settings() -> SettingsSnapshot:
+    """Загружает настройки одной сессией и атомарно подменяет снимок"""
+    global settings_snapshot, settings_checked_at
     async with async_session() as session:
+        version = await session.scalar(select(SettingsVersion.version).where(SettingsVersion.id == 1))
         rate = await session.scalar(select(Rate.rate_value).where(Rate.id == 1))
-        return rate
+        support_contact = await session.scalar(select(Support.support_value).where(Support.id == 1))
+        wallets = (await session.execute(
+            select(Wallet.id, Wallet.network, Wallet.address).order_by(Wallet.id)
+        )).all()
+
+    wallets = tuple(WalletInfo(*wallet) for wallet in wallets)
+    wallets_by_network = {}
+    for wallet in wallets:
+        wallets_by_network.setdefault(wallet.network, []).append(wallet)
+
+    settings_snapshot = SettingsSnapshot(
+        version=version or 0,
+        rate=rate,
+        support_contact=support_contact,
+        wallets=wallets,
+        wallets_by_network={network: tuple(items) for network, items in wallets_by_network.items()}
+    )
+    settings_checked_at = time.monotonic()
+    return settings_snapshot
+
+
+async def get_settings() -> SettingsSnapshot:
+    """
+    Возвращает снимок настроек процесса
+
+    Пока снимок свежий, БД не запрашивается. Раз в SETTINGS_VERSION_CHECK_INTERVAL
+    секунд сверяется счётчик версии, и снимок перезагружается, только если
+    настройки поменял другой процесс.
+    """
+    global settings_checked_at
+    snapshot = settings_snapshot
+    if snapshot is not None and time.monotonic() - settings_checked_at < SETTINGS_VERSION_CHECK_INTERVAL:
+        return snapshot
+
+    async with settings_lock:
+        snapshot = settings_snapshot
+        if snapshot is not None and time.monotonic() - settings_checked_at < SETTINGS_VERSION_CHECK_INTERVAL:
+            return snapshot
+        if snapshot is not None:
+            async with async_session() as session:
+                version = await session.scalar(select(SettingsVersion.version).where(SettingsVersion.id == 1))
+            if (version or 0) == snapshot.version:
+                settings_checked_at = time.monotonic()
+                return snapshot
+        return await reload_settings()
+
+
+# Функция для получения всех кошельков из снимка настроек
+async def get_wallets():
+    return list((await get_settings()).wallets)
+
+
+async def get_open_orders_by_wallet(addresses: List[str], session: AsyncSession = None) -> Dict[str, int]:
+    """Считает незавершённые ордера по адресам кошельков одним GROUP BY"""
+    async with session_scope(session) as session:
+        result = await session.execute(
+            select(Order.wallet, func.count())
+            .where(Order.wallet.in_(addresses), Order.status.not_in(FINAL_STATUSES))
+            .group_by(Order.wallet)
+        )
+        return {wallet: count for wallet, count in result.all()}
+
 
+async def get_orders_volume(statuses: List[int] = None, since: datetime = None,
+                            session: AsyncSession = None) -> Dict[str, Any]:
+    """
+    Количество ордеров и объём в USDT одним SUM по value_minor
+
+    Args:
+        statuses: Коды OrderStatus, по умолчанию все ордера
+        since: Учитывать ордера, созданные не раньше этой даты
+    """
+    query = select(func.count(), func.coalesce(func.sum(Order.value), 0)).select_from(Order)
+    if statuses:
+        query = query.where(Order.status.in_(statuses))
+    if since:
+        query = query.where(Order.date_created >= since)
+
+    async with session_scope(session) as session:
+        count, volume = (await session.execute(query)).one()
+    return {"count": count, "usdt": volume}
+
+
+# Функция для получения текущего значения курса
+async def get_rate():
+    return (await get_settings()).rate
 
-# Функция для получения контакта поддержки из таблицы Support
+
+# Функция для получения контакта поддержки
 async def get_support_contact():
-    async with async_session() as session:
-        result = await session.scalar(select(Support.support_value).where(Support.id == 1))
-        return result
+    return (await get_settings()).support_contact
 
 
 # Функция для обновления курса администратором
-async def update_rate(new_rate_value: float):
-    async with async_session() as session:
+async def update_rate(new_rate_value: Decimal, session: AsyncSession = None):
+    async with session_scope(session) as session:
         # Получаем текущую запись с курсом по фиксированному ID
         rate = await session.scalar(select(Rate).where(Rate.id == 1))
 
@@ -110,15 +298,16 @@ async def update_rate(new_rate_value: float):
             await session.execute(
                 update(Rate).where(Rate.id == 1).values(rate_value=new_rate_value)
             )
-            await session.commit()
         else:
             # Если записи еще нет, создаем новую
             session.add(Rate(rate_value=new_rate_value))
-            await session.commit()
+        await bump_settings_version(session)
+        await session.commit()
+    await reload_settings()
 
 
-async def update_support_contact(new_support_contact):
-    async with async_session() as session:
+async def update_support_contact(new_support_contact, session: AsyncSession = None):
+    async with session_scope(session) as session:
         try:
             # Получаем текущую запись контакта по фиксированному ID
             contact = await session.scalar(select(Support).where(Support.id == 1))
@@ -132,23 +321,28 @@ async def update_support_contact(new_support_contact):
                 # Если записи еще нет, создаем новую
                 session.add(Support(id=1, support_value=new_support_contact))
 
+            await bump_settings_version(session)
             await session.commit()
         except Exception as e:
             await session.rollback()
             print(f"Ошибка при обновлении контакта поддержки: {e}")
+            return
+    await reload_settings()
 
 
-async def add_wallet(network: str, address: str):
-    async with async_session() as session:
+async def add_wallet(network: str, address: str, session: AsyncSession = None):
+    async with session_scope(session) as session:
         new_wallet = Wallet(network=network, address=address)
         session.add(new_wallet)
+        await bump_settings_version(session)
         await session.commit()
+    await reload_settings()
 
 
-async def delete_wallet(wallet_address: str) -> bool:
+async def delete_wallet(wallet_address: str, session: AsyncSession = None) -> bool:
 
     try:
-        async with async_session() as session:
+        async with session_scope(session) as session:
             # Find the wallet by address
             result = await session.execute(
                 select(Wallet).where(Wallet.address == wallet_address)
@@ -157,59 +351,96 @@ async def delete_wallet(wallet_address: str) -> bool:
 
             if wallet:
                 await session.delete(wallet)
+                await bump_settings_version(session)
                 await session.commit()
-                return True
             else:
                 return False
 
+        await reload_settings()
+        return True
+
     except Exception as e:
         logging.error(f"Error deleting wallet: {e}")
         return False
 
 
-async def create_order(user_id, currency, value, exchange_rate, network, bank_card, wallet):
-    async with async_session() as session:
+async def create_order(user_id, currency, value: Decimal, exchange_rate: Decimal, network, bank_card, wallet,
+                       idempotency_key: str = None,
+                       notifications: Callable[[int], List[Dict[str, Any]]] = None,
+                       session: AsyncSession = None) -> tuple[Dict[str, Any], bool]:
+    """
+    Создаёт ордер со статусом «Ожидает оплаты»
+
+    Ордер вставляется одним INSERT ... ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING, поэтому после commit не нужно перечитывать строку. Если ордер
+    с таким ключом уже есть (повторное нажатие «Подтвердить»), возвращается он,
+    а уведомления не записываются. notifications — функция, которая по ID нового
+    ордера возвращает уведомления для outbox; они пишутся в той же транзакции.
+
+    Returns:
+        tuple[dict, bool]: Ордер как в get_order_info и True, если он создан сейчас
+    """
+    async with session_scope(session) as session:
         try:
-            new_order = Order(
-                user_id=user_id,
-                currency=currency,
-                value=value,
-                exchange_rate=exchange_rate,
-                network=network,
-                bank_card=bank_card,
-                wallet=wallet,
-                status='Ожидает оплаты'
+            new_order = await session.scalar(
+                dialect_insert(Order)
+                .values(
+                    user_id=user_id,
+                    currency=currency,
+                    value=value,
+                    exchange_rate=exchange_rate,
+                    network=network,
+                    bank_card=bank_card,
+                    wallet=wallet,
+                    status=OrderStatus.AWAITING_PAYMENT,
+                    idempotency_key=idempotency_key
+                )
+                .on_conflict_do_nothing(index_elements=[Order.idempotency_key])
+                .returning(Order)
             )
-            session.add(new_order)
+            if new_order is None:
+                await session.rollback()
+                existing = await session.scalar(select(Order).where(Order.idempotency_key == idempotency_key))
+                logging.info(f"Order {existing.id} already created for idempotency key {idempotency_key}")
+                return order_as_dict(existing), False
+
+            order_info = order_as_dict(new_order)
+            if notifications:
+                await add_outbox_messages(session, notifications(new_order.id), new_order.id)
             await session.commit()
-            # Обновляем объект new_order после коммита
-            await session.refresh(new_order)
-            return new_order.id  # Возвращаем ID созданного заказа
+            order_totals_cache.pop(None)
+            order_totals_cache.pop(user_id)
+            return order_info, True
         except Exception as e:
             await session.rollback()
             logging.error(f"Error creating order: {e}")
             raise
 
 
-async def get_order_info(id):
-    async with async_session() as session:
+def order_as_dict(order: Order) -> Dict[str, Any]:
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "currency": order.currency,
+        "value": order.value,
+        "exchange_rate": order.exchange_rate,
+        "network": order.network,
+        "bank_card": order.bank_card,
+        "wallet": order.wallet,
+        "status": status_text(order.status),
+        "status_code": order.status,
+        "file_id": order.file_id,
+        "date_created": order.date_created,
+        "date_payment": order.date_payment
+    }
+
+
+async def get_order_info(id, session: AsyncSession = None):
+    async with session_scope(session) as session:
         try:
             order = await session.scalar(select(Order).where(Order.id == id))
             if order:
-                return {
-                    "id": order.id,
-                    "user_id": order.user_id,
-                    "currency": order.currency,
-                    "value": order.value,
-                    "exchange_rate": order.exchange_rate,
-                    "network": order.network,
-                    "bank_card": order.bank_card,
-                    "wallet": order.wallet,
-                    "status": order.status,
-                    "file_id": order.file_id,
-                    "date_created": order.date_created,
-                    "date_payment": order.date_payment
-                }
+                return order_as_dict(order)
             logging.warning(f"Order with id {id} not found")
             return None
         except Exception as e:
@@ -217,42 +448,71 @@ async def get_order_info(id):
             return None
 
 
-async def update_order_status(order_id: int, new_status: str, file_id: str = None, payment_date: datetime = None):
+async def transition_order_status(order_id: int, new_status: OrderStatus, file_id: str = None,
+                                  payment_date: datetime = None, notifications=None,
+                                  session: AsyncSession = None) -> Optional[Dict[str, Any]]:
     """
-    Update order status and file_id in database.
+    Переводит ордер в новый статус, если это разрешено из текущего
 
-    Args:
-        order_id (int): ID of the order to update
-        new_status (str): New status for the order
-        file_id (str, optional): Telegram file_id of the payment screenshot
-        payment_date (datetime, optional): Date and time when payment screenshot was received
-    """
-    async with async_session() as session:
-        try:
-            values = {"status": new_status}
+    Проверка и запись — один UPDATE orders ... WHERE id = ? AND status IN (...)
+    RETURNING, поэтому из двух одновременных нажатий срабатывает только одно.
+    Для завершения и отмены проставляются date_finished и date_canceled.
 
-            if file_id is not None:
-                values["file_id"] = file_id
+    Args:
+        order_id: ID ордера
+        new_status: Новый статус
+        file_id: file_id скриншота оплаты
+        payment_date: Время получения скриншота оплаты
+        notifications: Уведомления для outbox или функция, которая строит их
+            по обновлённому ордеру; записываются в той же транзакции
 
-            if payment_date is not None:
-                values["date_payment"] = payment_date
+    Returns:
+        dict | None: Обновлённый ордер как в get_order_info или None, если ордер
+            не найден либо уже в статусе, из которого переход запрещён
 
-            await session.execute(
+    Raises:
+        Exception: Ошибка базы данных пробрасывается, чтобы её не приняли за конфликт
+    """
+    allowed_from = [status for status, targets in TRANSITIONS.items() if new_status in targets]
+    values = {"status": new_status}
+    if file_id is not None:
+        values["file_id"] = file_id
+    if payment_date is not None:
+        values["date_payment"] = payment_date
+    if new_status == OrderStatus.COMPLETED:
+        values["date_finished"] = datetime.utcnow()
+    elif new_status in (OrderStatus.CANCELED_BY_ADMIN, OrderStatus.CANCELED_BY_USER):
+        values["date_canceled"] = datetime.utcnow()
+
+    async with session_scope(session) as session:
+        try:
+            order = await session.scalar(
                 update(Order)
-                .where(Order.id == order_id)
+                .where(Order.id == order_id, Order.status.in_(allowed_from))
                 .values(**values)
+                .returning(Order)
             )
+            if order is None:
+                await session.rollback()
+                logging.info(f"Order {order_id} cannot be moved to status {new_status.name}")
+                return None
+
+            order_info = order_as_dict(order)
+            if notifications:
+                if callable(notifications):
+                    notifications = notifications(order_info)
+                await add_outbox_messages(session, notifications, order_id)
             await session.commit()
-            return True
+            return order_info
         except Exception as e:
             logging.error(f"Error updating order status: {e}")
             await session.rollback()
-            return False
+            raise
 
 
-async def get_order_status(id: int) -> str | None:
+async def get_order_status(id: int, session: AsyncSession = None) -> int | None:
 
-    async with async_session() as session:
+    async with session_scope(session) as session:
         try:
             status = await session.scalar(
                 select(Order.status).where(Order.id == id)
@@ -263,8 +523,101 @@ async def get_order_status(id: int) -> str | None:
             return None
 
 
-async def get_orders(offset: int = 0, limit: int = 10):
+async def add_outbox_messages(session: AsyncSession, messages: List[Dict[str, Any]], order_id: int = None):
+    """
+    Записывает уведомления в outbox в текущей транзакции, без commit
+
+    Уведомление без chat_id адресуется владельцу ордера order_id: его chat_id
+    подставляется INSERT ... SELECT из orders. Уведомления с уже записанным
+    dedupe_key пропускаются через ON CONFLICT DO NOTHING.
+    next_attempt_at ставится по UTC из Python, как и время опроса в воркере.
+    """
+    now = datetime.utcnow()
+    direct = [{**message, "next_attempt_at": now} for message in messages if message.get("chat_id") is not None]
+    if direct:
+        await session.execute(
+            dialect_insert(OutboxMessage).values(direct).on_conflict_do_nothing(index_elements=["dedupe_key"])
+        )
+
+    for message in messages:
+        if message.get("chat_id") is not None:
+            continue
+        if order_id is None:
+            raise ValueError("Outbox message without chat_id requires order_id")
+        await session.execute(
+            dialect_insert(OutboxMessage).from_select(
+                ["chat_id", "text", "photo", "reply_markup", "dedupe_key", "next_attempt_at"],
+                select(Order.user_id, literal(message.get("text")), literal(message.get("photo")),
+                       literal(message.get("reply_markup"), JSON), literal(message.get("dedupe_key")),
+                       literal(now, DateTime))
+                .where(Order.id == order_id)
+            ).on_conflict_do_nothing(index_elements=["dedupe_key"])
+        )
+
+
+async def claim_outbox_messages(now: datetime, limit: int, lease_until: datetime) -> List[Dict[str, Any]]:
+    """
+    Забирает пачку уведомлений, время отправки которых наступило
+
+    Выборка и захват — один UPDATE ... RETURNING: строки переводятся в status='sending'
+    с next_attempt_at=lease_until, поэтому второй процесс их не получит. Если процесс
+    упал во время отправки, после lease_until уведомление снова станет доступным.
+    В PostgreSQL строки, которые прямо сейчас захватывает другой процесс, пропускаются
+    через SKIP LOCKED.
+    """
+    due = (OutboxMessage.status.in_(('pending', 'sending')), OutboxMessage.next_attempt_at <= now)
+    batch = (
+        select(OutboxMessage.id)
+        .where(*due)
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with async_session() as session:
+        result = await session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(batch.scalar_subquery()), *due)
+            .values(status='sending', next_attempt_at=lease_until)
+            .returning(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text, OutboxMessage.photo,
+                       OutboxMessage.reply_markup, OutboxMessage.attempts)
+        )
+        messages = [row._asdict() for row in result.all()]
+        await session.commit()
+    return sorted(messages, key=lambda message: message["id"])
+
+
+async def mark_outbox_sent(message_ids: List[int]):
+    """Отмечает уведомления отправленными одним UPDATE"""
+    if not message_ids:
+        return
+    async with async_session() as session:
+        await session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(message_ids))
+            .values(status='sent', date_sent=datetime.utcnow())
+        )
+        await session.commit()
+
+
+async def reschedule_outbox_message(message_id: int, attempts: int, error: str, next_attempt_at: datetime = None):
+    """
+    Записывает неудачную попытку отправки
+
+    Без next_attempt_at уведомление больше не отправляется (status='failed').
+    """
+    values = {"attempts": attempts, "last_error": error[:500]}
+    if next_attempt_at is None:
+        values["status"] = 'failed'
+    else:
+        values["status"] = 'pending'
+        values["next_attempt_at"] = next_attempt_at
     async with async_session() as session:
+        await session.execute(update(OutboxMessage).where(OutboxMessage.id == message_id).values(**values))
+        await session.commit()
+
+
+async def get_orders(offset: int = 0, limit: int = 10, session: AsyncSession = None):
+    async with session_scope(session) as session:
         try:
             result = await session.execute(
                 select(Order.id).offset(offset).limit(limit).order_by(Order.date_created.desc())
@@ -276,183 +629,465 @@ async def get_orders(offset: int = 0, limit: int = 10):
             return []
 
 
-async def get_orders_page(page: int = 1, per_page: int = 10) -> List[Order]:
+def encode_order_cursor(order: Order) -> str:
     """
-    Получает страницу ордеров из базы данных
+    Кодирует позицию ордера (date_created, id) для callback_data
 
-    Args:
-        page: Номер страницы
-        per_page: Количество ордеров на странице
-
-    Returns:
-        List[Order]: Список объектов Order для указанной страницы
+    Время хранится в микросекундах от эпохи, оба числа — в base36,
+    чтобы курсор укладывался в лимит callback_data в 64 байта.
     """
-    async with async_session() as session:
-        try:
-            skip = (page - 1) * per_page
-            query = select(Order).order_by(Order.date_created.desc()).offset(skip).limit(per_page)
-            result = await session.scalars(query)
-            return list(result)
-        except Exception as e:
-            logging.error(f"Error getting orders page: {e}")
-            return []
+    delta = order.date_created - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return f"{to_base36(micros)}-{to_base36(order.id)}"
+
+
+def decode_order_cursor(cursor: str) -> tuple:
+    micros, order_id = cursor.split("-")
+    return EPOCH + timedelta(microseconds=int(micros, 36)), int(order_id, 36)
+
+
+def to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if number == 0:
+            return result
 
 
-async def get_total_orders() -> int:
+def orders_keyset_query(per_page: int, cursor: str = None, direction: str = "next", user_id: int = None):
     """
-    Получает общее количество ордеров в базе данных
+    Собирает запрос страницы ордеров с пагинацией по ключу (date_created, id)
 
-    Returns:
-        int: Общее количество ордеров
+    Вместо OFFSET страница начинается сразу за курсором, поэтому любая
+    страница стоит столько же, сколько первая, и не сдвигается от новых ордеров.
+
+    Args:
+        per_page: Количество ордеров на странице
+        cursor: Позиция из encode_order_cursor, от которой листать
+        direction: "next" — более старые ордера, "prev" — более новые
+        user_id: Если указан, только ордера этого пользователя
     """
-    async with async_session() as session:
-        try:
-            query = select(func.count()).select_from(Order)
-            result = await session.scalar(query)
-            return result
-        except Exception as e:
-            logging.error(f"Error getting total orders count: {e}")
-            return 0
+    key = tuple_(Order.date_created, Order.id)
+    query = select(Order)
+    if user_id is not None:
+        query = query.where(Order.user_id == user_id)
+
+    if cursor and direction == "prev":
+        query = query.where(key > tuple_(*decode_order_cursor(cursor)))
+        return query.order_by(Order.date_created.asc(), Order.id.asc()).limit(per_page)
 
+    if cursor:
+        query = query.where(key < tuple_(*decode_order_cursor(cursor)))
+    return query.order_by(Order.date_created.desc(), Order.id.desc()).limit(per_page)
 
-async def get_orders_page_with_total(page: int = 1, per_page: int = 10) -> Dict[str, Any]:
+
+async def get_orders_page_with_total(cursor: str = None, direction: str = "next", per_page: int = 10,
+                                     user_id: int = None, with_total: bool = True,
+                                     session: AsyncSession = None) -> Dict[str, Any]:
     """
-    Получает страницу ордеров вместе с информацией о пагинации
+    Получает страницу ордеров вместе с информацией о пагинации за один запрос
+
+    Страница выбирается по ключу с одной лишней строкой, по которой видно,
+    есть ли следующая страница. Общее количество берётся из кэша, а если его
+    там нет — считается скалярным подзапросом в том же SELECT.
 
     Args:
-        page: Номер страницы
+        cursor: Позиция, от которой листать; без курсора — первая страница
+        direction: "next" или "prev"
         per_page: Количество ордеров на странице
+        user_id: Если указан, только ордера этого пользователя
+        with_total: False — не считать общее количество, только has_next/has_prev
 
     Returns:
         Dict с ключами:
-            orders: List[Order] - список ордеров
-            total: int - общее количество ордеров
-            total_pages: int - общее количество страниц
+            orders: List[Order] - список ордеров, от новых к старым
+            total: int | None - общее количество ордеров
+            total_pages: int | None - общее количество страниц
+            has_next: bool - есть ли более старые ордера
+            has_prev: bool - есть ли более новые ордера
     """
     try:
-        logging.info(f"Fetching orders for page {page}")
-        orders = await get_orders_page(page, per_page)
-        total = await get_total_orders()
-        total_pages = (total + per_page - 1) // per_page
+        total = order_totals_cache.get(user_id) if with_total else None
+        count_in_query = with_total and total is None
+
+        query = orders_keyset_query(per_page + 1, cursor, direction, user_id)
+        if count_in_query:
+            count_query = select(func.count()).select_from(Order)
+            if user_id is not None:
+                count_query = count_query.where(Order.user_id == user_id)
+            query = query.add_columns(count_query.scalar_subquery())
+
+        async with session_scope(session) as session:
+            rows = (await session.execute(query)).all()
+            if count_in_query:
+                if rows:
+                    total = rows[0][1]
+                elif cursor is None:
+                    total = 0
+                else:
+                    # Пустая страница за курсором — редкий случай, считаем отдельно
+                    total = await session.scalar(count_query)
+                order_totals_cache.set(user_id, total)
+
+        orders = [row[0] for row in rows]
+        has_more = len(orders) > per_page
+        orders = orders[:per_page]
+        if cursor and direction == "prev":
+            orders.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None
 
+        total_pages = (total + per_page - 1) // per_page if total is not None else None
         logging.info(f"Found {len(orders)} orders, total pages: {total_pages}")
         return {
             "orders": orders,
             "total": total,
-            "total_pages": total_pages
+            "total_pages": total_pages,
+            "has_next": has_next,
+            "has_prev": has_prev
         }
     except Exception as e:
         logging.error(f"Error getting orders page with total: {e}")
         return {
             "orders": [],
             "total": 0,
-            "total_pages": 0
+            "total_pages": 0,
+            "has_next": False,
+            "has_prev": False
         }
 
 
-async def get_all_users():
-    async with async_session() as session:
+# Сегменты получателей рассылки
+MAILING_SEGMENTS = {
+    "all": "Все пользователи",
+    "complete": "С заполненным профилем",
+    "with_orders": "Создавали ордера",
+    "inactive": "Без ордеров с даты"
+}
+
+
+def mailing_segment_filter(segment: str, since: datetime = None) -> list:
+    """
+    Собирает SQL-условия по users для сегмента рассылки
+
+    Заблокировавшие бота пользователи отсекаются всегда по индексу users.is_blocked,
+    условия по ордерам — коррелированный EXISTS по orders.user_id.
+
+    Args:
+        segment: Ключ из MAILING_SEGMENTS
+        since: Дата для сегмента inactive
+    """
+    conditions = [User.is_blocked == false()]
+    if segment == "complete":
+        conditions.append(User.profile_complete.is_(True))
+    elif segment == "with_orders":
+        conditions.append(select(Order.id).where(Order.user_id == User.tg_id).exists())
+    elif segment == "inactive":
+        if since is None:
+            raise ValueError("Segment 'inactive' requires a date")
+        conditions.append(
+            ~select(Order.id).where(Order.user_id == User.tg_id, Order.date_created >= since).exists()
+        )
+    elif segment != "all":
+        raise ValueError(f"Unknown mailing segment: {segment}")
+    return conditions
+
+
+async def count_segment_users(segment: str, since: datetime = None, session: AsyncSession = None) -> int:
+    """Считает получателей сегмента одним COUNT-запросом"""
+    async with session_scope(session) as session:
         try:
-            result = await session.execute(select(User))
-            users = result.scalars().all()
-            return users
+            result = await session.scalar(
+                select(func.count()).select_from(User).where(*mailing_segment_filter(segment, since))
+            )
+            return result or 0
         except Exception as e:
-            logging.error(f"Error fetching users: {e}")
-            return []
+            logging.error(f"Error counting users for segment {segment}: {e}")
+            return 0
 
 
-async def get_orders_page_for_user(user_id: int, page: int = 1, per_page: int = 10) -> List[Order]:
+async def fill_broadcast_recipients(session, job: BroadcastJob):
     """
-    Получает страницу ордеров пользователя из базы данных
+    Фиксирует список получателей задания
 
-    Args:
-        user_id: ID пользователя (tg_id)
-        page: Номер страницы
-        per_page: Количество ордеров на странице
+    Получатели сегмента копируются одним INSERT ... SELECT из users,
+    поэтому строки пользователей не проходят через Python.
+    """
+    result = await session.execute(
+        insert(BroadcastRecipient).from_select(
+            ['job_id', 'tg_id', 'status'],
+            select(literal(job.id), User.tg_id, literal('pending'))
+            .where(*mailing_segment_filter(job.segment, job.segment_since))
+        )
+    )
+    job.total_count = result.rowcount
+
+
+async def create_broadcast_job(admin_chat_id: int, message_text: str = None, photo: str = None,
+                               buttons: list = None, segment: str = "all", since: datetime = None,
+                               source_chat_id: int = None, source_message_ids: List[int] = None,
+                               scheduled_at: datetime = None, spread_minutes: int = None,
+                               session: AsyncSession = None) -> int:
+    """
+    Создаёт задание рассылки
+
+    Для немедленной рассылки получатели фиксируются сразу, для отложенной —
+    в момент запуска, чтобы сегмент отражал актуальные данные.
 
     Returns:
-        List[Order]: Список объектов Order для указанной страницы
+        int: ID задания рассылки
     """
-    async with async_session() as session:
+    async with session_scope(session) as session:
         try:
-            skip = (page - 1) * per_page
-            query = (
-                select(Order)
-                .where(Order.user_id == user_id)  # Фильтр по user_id
-                .order_by(Order.date_created.desc())
-                .offset(skip)
-                .limit(per_page)
+            job = BroadcastJob(
+                admin_chat_id=admin_chat_id,
+                message_text=message_text,
+                photo=photo,
+                buttons=buttons or [],
+                source_chat_id=source_chat_id,
+                source_message_ids=source_message_ids,
+                segment=segment,
+                segment_since=since,
+                scheduled_at=scheduled_at,
+                spread_minutes=spread_minutes,
+                status='scheduled' if scheduled_at else 'running'
             )
-            result = await session.scalars(query)
-            return list(result)
+            session.add(job)
+            await session.flush()
+
+            if not scheduled_at:
+                await fill_broadcast_recipients(session, job)
+            # После commit атрибуты истекают, а ленивая загрузка в async-сессии невозможна
+            job_id = job.id
+            await session.commit()
+            return job_id
         except Exception as e:
-            logging.error(f"Error getting orders page for user {user_id}: {e}")
-            return []
+            await session.rollback()
+            logging.error(f"Error creating broadcast job: {e}")
+            raise
+
+
+async def get_due_broadcast_jobs(now: datetime) -> List[int]:
+    async with async_session() as session:
+        result = await session.scalars(
+            select(BroadcastJob.id)
+            .where(BroadcastJob.status == 'scheduled', BroadcastJob.scheduled_at <= now)
+            .order_by(BroadcastJob.scheduled_at)
+        )
+        return list(result)
 
 
-async def get_total_orders_for_user(user_id: int) -> int:
+async def activate_scheduled_broadcast_job(job_id: int) -> bool:
     """
-    Получает общее количество ордеров пользователя в базе данных
+    Переводит отложенное задание в работу и фиксирует получателей
 
-    Args:
-        user_id: ID пользователя (tg_id)
+    Статус меняется условным UPDATE, поэтому задание не запустится дважды.
 
     Returns:
-        int: Общее количество ордеров пользователя
+        bool: True, если задание было запущено этим вызовом
     """
     async with async_session() as session:
         try:
-            query = (
-                select(func.count())
-                .select_from(Order)
-                .where(Order.user_id == user_id)  # Фильтр по user_id
+            result = await session.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job_id, BroadcastJob.status == 'scheduled')
+                .values(status='running')
             )
-            result = await session.scalar(query)
-            return result
+            if result.rowcount == 0:
+                await session.rollback()
+                return False
+
+            job = await session.scalar(select(BroadcastJob).where(BroadcastJob.id == job_id))
+            await fill_broadcast_recipients(session, job)
+            await session.commit()
+            return True
         except Exception as e:
-            logging.error(f"Error getting total orders count for user {user_id}: {e}")
-            return 0
+            logging.error(f"Error activating broadcast job {job_id}: {e}")
+            await session.rollback()
+            return False
+
+
+async def get_broadcast_job(job_id: int) -> Optional[Dict[str, Any]]:
+    async with async_session() as session:
+        job = await session.scalar(select(BroadcastJob).where(BroadcastJob.id == job_id))
+        if job:
+            return {
+                "id": job.id,
+                "admin_chat_id": job.admin_chat_id,
+                "progress_message_id": job.progress_message_id,
+                "message_text": job.message_text,
+                "photo": job.photo,
+                "buttons": job.buttons or [],
+                "source_chat_id": job.source_chat_id,
+                "source_message_ids": job.source_message_ids or [],
+                "status": job.status,
+                "total_count": job.total_count,
+                "scheduled_at": job.scheduled_at,
+                "spread_minutes": job.spread_minutes,
+                "success_count": job.success_count,
+                "fail_count": job.fail_count
+            }
+        return None
+
+
+async def set_broadcast_progress_message(job_id: int, message_id: int):
+    async with async_session() as session:
+        await session.execute(
+            update(BroadcastJob).where(BroadcastJob.id == job_id).values(progress_message_id=message_id)
+        )
+        await session.commit()
 
 
-async def get_orders_page_with_total_for_user(user_id: int, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
+async def set_broadcast_job_status(job_id: int, new_status: str, from_statuses: List[str] = None) -> bool:
     """
-    Получает страницу ордеров пользователя вместе с информацией о пагинации
+    Меняет статус задания рассылки
 
     Args:
-        user_id: ID пользователя (tg_id)
-        page: Номер страницы
-        per_page: Количество ордеров на странице
+        job_id: ID задания
+        new_status: Новый статус
+        from_statuses: Если указан, статус меняется только из этих статусов
 
     Returns:
-        Dict с ключами:
-            orders: List[Order] - список ордеров пользователя
-            total: int - общее количество ордеров пользователя
-            total_pages: int - общее количество страниц
+        bool: True, если задание было обновлено
     """
-    try:
-        # Заменяем get_orders_page на get_orders_page_for_user
-        orders = await get_orders_page_for_user(user_id, page, per_page)
-        total = await get_total_orders_for_user(user_id)
-        total_pages = (total + per_page - 1) // per_page
+    async with async_session() as session:
+        try:
+            values = {"status": new_status}
+            if new_status in ('finished', 'canceled'):
+                values["date_finished"] = datetime.utcnow()
 
-        return {
-            "orders": orders,
-            "total": total,
-            "total_pages": total_pages
-        }
-    except Exception as e:
-        logging.error(f"Error getting orders page with total for user {user_id}: {e}")
-        return {
-            "orders": [],
-            "total": 0,
-            "total_pages": 0
-        }
+            query = update(BroadcastJob).where(BroadcastJob.id == job_id)
+            if from_statuses:
+                query = query.where(BroadcastJob.status.in_(from_statuses))
+            result = await session.execute(query.values(**values))
+            await session.commit()
+            return result.rowcount > 0
+        except Exception as e:
+            logging.error(f"Error updating broadcast job {job_id} status: {e}")
+            await session.rollback()
+            return False
 
 
-async def is_profile_complete(tg_id: int) -> bool:
-    """Проверяет, заполнены ли все обязательные поля профиля пользователя."""
-    user_info = await get_user_info(tg_id)
-    if user_info is None:
-        return False
-    required_fields = ['phone_number', 'nickname', 'bank_card']
-    return all(user_info[field] is not None and user_info[field] != '' for field in required_fields)
+async def get_broadcast_jobs_by_status(status: str) -> List[int]:
+    async with async_session() as session:
+        result = await session.scalars(
+            select(BroadcastJob.id).where(BroadcastJob.status == status).order_by(BroadcastJob.id)
+        )
+        return list(result)
+
+
+async def iter_pending_recipients(job_id: int, chunk_size: int = 1000):
+    """
+    Постранично выдаёт tg_id получателей, которым ещё не отправлена рассылка
+
+    Выбирается только tg_id, страницы берутся по ключу (tg_id > последний),
+    поэтому память не растёт вместе с количеством получателей.
+    Перед каждой страницей проверяется статус задания: на паузе
+    или после отмены выдача прекращается.
+
+    Args:
+        job_id: ID задания рассылки
+        chunk_size: Количество id в одном запросе
+    """
+    last_id = None
+    while True:
+        async with async_session() as session:
+            status = await session.scalar(select(BroadcastJob.status).where(BroadcastJob.id == job_id))
+            if status != 'running':
+                return
+
+            query = (
+                select(BroadcastRecipient.tg_id)
+                .where(BroadcastRecipient.job_id == job_id, BroadcastRecipient.status == 'pending')
+                .order_by(BroadcastRecipient.tg_id)
+                .limit(chunk_size)
+            )
+            if last_id is not None:
+                query = query.where(BroadcastRecipient.tg_id > last_id)
+            result = await session.scalars(query)
+            ids = list(result)
+
+        for tg_id in ids:
+            yield tg_id
+
+        if len(ids) < chunk_size:
+            return
+        last_id = ids[-1]
+
+
+async def count_pending_recipients(job_id: int) -> int:
+    async with async_session() as session:
+        result = await session.scalar(
+            select(func.count())
+            .select_from(BroadcastRecipient)
+            .where(BroadcastRecipient.job_id == job_id, BroadcastRecipient.status == 'pending')
+        )
+        return result or 0
+
+
+async def save_broadcast_results(job_id: int, sent_ids: List[int], failed_ids: List[int],
+                                 blocked_ids: List[int] = None):
+    """
+    Пакетно записывает результаты доставки и обновляет счётчики задания
+
+    Пользователи из blocked_ids помечаются заблокированными одним UPDATE
+    и больше не попадают в новые рассылки. Ошибка записи пробрасывается:
+    иначе получатели остались бы pending и получили сообщение повторно.
+    """
+    blocked_ids = blocked_ids or []
+    async with async_session() as session:
+        try:
+            for status, ids in (('sent', sent_ids), ('failed', failed_ids), ('blocked', blocked_ids)):
+                if ids:
+                    await session.execute(
+                        update(BroadcastRecipient)
+                        .where(BroadcastRecipient.job_id == job_id, BroadcastRecipient.tg_id.in_(ids))
+                        .values(status=status)
+                    )
+            if blocked_ids:
+                await session.execute(
+                    update(User)
+                    .where(User.tg_id.in_(blocked_ids))
+                    .values(is_blocked=True, blocked_at=datetime.utcnow())
+                )
+            await session.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job_id)
+                .values(success_count=BroadcastJob.success_count + len(sent_ids),
+                        fail_count=BroadcastJob.fail_count + len(failed_ids) + len(blocked_ids))
+            )
+            await session.commit()
+        except Exception as e:
+            logging.error(f"Error saving broadcast results for job {job_id}: {e}")
+            await session.rollback()
+            raise
+
+
+async def get_orders_page_with_total_for_user(user_id: int, cursor: str = None, direction: str = "next",
+                                              per_page: int = 10, with_total: bool = True,
+                                              session: AsyncSession = None) -> Dict[str, Any]:
+    """Страница ордеров пользователя, см. get_orders_page_with_total"""
+    return await get_orders_page_with_total(cursor, direction, per_page, user_id, with_total, session=session)
+
+
+async def is_profile_complete(tg_id: int, session: AsyncSession = None) -> bool:
+    """
+    Проверяет, заполнены ли все обязательные поля профиля пользователя.
+
+    Читается флаг users.profile_complete, который ставится при завершении
+    регистрации. Результат кэшируется по tg_id и сбрасывается при изменении
+    профиля, поэтому обычные сообщения проходят проверку без запроса к БД.
+    """
+    complete = profile_complete_cache.get(tg_id)
+    if complete is not None:
+        return complete
+
+    async with session_scope(session) as session:
+        complete = await session.scalar(select(User.profile_complete).where(User.tg_id == tg_id))
+
+    complete = bool(complete)
+    profile_complete_cache.set(tg_id, complete)
+    return complete
@@ -0,0 +1,42 @@
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """Простые счётчики и показатели процесса бота"""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.started_at = time.monotonic()
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def discard(self, name: str):
+        self.gauges.pop(name, None)
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime": time.monotonic() - self.started_at,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges)
+        }
+
+    def render(self) -> str:
+        """Текстовый отчёт по snapshot() для администратора"""
+        snapshot = self.snapshot()
+        lines = [f"⏱ Аптайм: {int(snapshot['uptime'])} с"]
+        if snapshot["counters"]:
+            lines.append("\nСчётчики:")
+            lines += [f"{name}: {value}" for name, value in sorted(snapshot["counters"].items())]
+        if snapshot["gauges"]:
+            lines.append("\nПоказатели:")
+            lines += [f"{name}: {value:g}" for name, value in sorted(snapshot["gauges"].items())]
+        return "\n".join(lines)
+
+
+metrics = Metrics()
@@ -1,24 +1,50 @@
 # В app/middlewares.py
 
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
 from aiogram.types import Message
+from app.database.models import async_session
 from app.database.requests import is_profile_complete
 from app.user_keyboard import phone_button
 from app.states import Form
 
 
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию БД на всё обновление и передаёт её в data['session']
+
+    Обработчики получают её параметром session и передают в функции
+    app.database.requests, поэтому за обновление берётся одно соединение.
+    Объекты не истекают после commit, чтобы их можно было читать дальше
+    в том же обработчике без повторных запросов.
+    """
+
+    def __init__(self, session_pool=async_session):
+        self.session_pool = session_pool
+
+    async def __call__(self, handler, event, data: dict):
+        async with self.session_pool(expire_on_commit=False) as session:
+            data['session'] = session
+            return await handler(event, data)
+
+
 class ProfileCheckMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
         tg_id = event.from_user.id
         state = data['state']
 
+        # Обработчики с флагом skip_profile_check сами разбираются с профилем:
+        # /start должен дойти до set_user, чтобы снять отметку о блокировке бота
+        if get_flag(data, "skip_profile_check"):
+            return await handler(event, data)
+
         # Пропускаем проверку для состояния регистрации
         current_state = await state.get_state()
         if current_state in [Form.phone_number, Form.nickname, Form.bank_card]:
             return await handler(event, data)
 
         # Проверяем полноту профиля
-        if not await is_profile_complete(tg_id):
+        if not await is_profile_complete(tg_id, session=data.get('session')):
             await event.answer(
                 "Ваш профиль не заполнен. Пожалуйста, завершите регистрацию, отправив номер телефона.",
                 reply_markup=phone_button
@@ -0,0 +1,73 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+
+# Количество знаков после запятой для сумм и курса
+USDT_PLACES = 6
+UAH_PLACES = 2
+RATE_PLACES = 4
+
+
+def to_decimal(value, places: int) -> Decimal:
+    """Приводит число или строку к Decimal с заданным количеством знаков"""
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def parse_amount(text: str) -> Decimal:
+    """Разбирает сумму или курс из сообщения, допускает запятую как разделитель"""
+    try:
+        value = Decimal(text.strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text}")
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {text}")
+    return value
+
+
+def uah_amount(usdt, rate) -> Decimal:
+    """Сумма в UAH за usdt по курсу rate"""
+    return to_decimal(Decimal(str(usdt)) * Decimal(str(rate)), UAH_PLACES)
+
+
+def usdt_amount(uah, rate) -> Decimal:
+    """Сумма в USDT, которую нужно отправить, чтобы получить uah по курсу rate"""
+    return to_decimal(Decimal(str(uah)) / Decimal(str(rate)), USDT_PLACES)
+
+
+def format_amount(value, places: int = 2) -> str:
+    """Сумма для сообщений, по умолчанию с двумя знаками"""
+    return f"{to_decimal(value, places):f}"
+
+
+def format_rate(value) -> str:
+    """Курс для сообщений без лишних нулей в конце"""
+    text = format_amount(value, RATE_PLACES)
+    return text.rstrip("0").rstrip(".")
+
+
+class Money(TypeDecorator):
+    """
+    Денежная колонка: в базе целое число минимальных единиц, в Python — Decimal
+
+    Суммы по такой колонке считаются через SUM в базе без приведения строк
+    и без погрешности float.
+    """
+
+    impl = BigInteger
+    cache_ok = True
+
+    def __init__(self, places: int):
+        super().__init__()
+        self.places = places
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(to_decimal(value, self.places).scaleb(self.places))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(int(value)).scaleb(-self.places)
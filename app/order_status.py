@@ -0,0 +1,65 @@
+from enum import IntEnum
+
+
+class OrderStatus(IntEnum):
+    """Коды статусов ордера, в базе хранится только число"""
+    AWAITING_PAYMENT = 1
+    PAID = 2
+    AWAITING_CONFIRMATION = 3
+    COMPLETED = 4
+    CANCELED_BY_ADMIN = 5
+    CANCELED_BY_USER = 6
+
+
+# Текст статуса для сообщений и кнопок
+STATUS_TEXT = {
+    OrderStatus.AWAITING_PAYMENT: "Ожидает оплаты",
+    OrderStatus.PAID: "Оплачено",
+    OrderStatus.AWAITING_CONFIRMATION: "Ожидает подтверждения⏳",
+    OrderStatus.COMPLETED: "Ордер завершен администратором✅",
+    OrderStatus.CANCELED_BY_ADMIN: "Ордер отменен администратором❌",
+    OrderStatus.CANCELED_BY_USER: "Ордер отменен пользователем",
+}
+
+# Допустимые переходы: из какого статуса в какие можно перевести ордер
+TRANSITIONS = {
+    OrderStatus.AWAITING_PAYMENT: {OrderStatus.PAID, OrderStatus.AWAITING_CONFIRMATION, OrderStatus.COMPLETED,
+                                   OrderStatus.CANCELED_BY_ADMIN, OrderStatus.CANCELED_BY_USER},
+    OrderStatus.PAID: {OrderStatus.AWAITING_CONFIRMATION, OrderStatus.COMPLETED,
+                       OrderStatus.CANCELED_BY_ADMIN, OrderStatus.CANCELED_BY_USER},
+    OrderStatus.AWAITING_CONFIRMATION: {OrderStatus.PAID, OrderStatus.COMPLETED,
+                                        OrderStatus.CANCELED_BY_ADMIN, OrderStatus.CANCELED_BY_USER},
+    OrderStatus.COMPLETED: set(),
+    OrderStatus.CANCELED_BY_ADMIN: set(),
+    OrderStatus.CANCELED_BY_USER: set(),
+}
+
+# Статусы, после которых ордер закрыт
+FINAL_STATUSES = frozenset(status for status, targets in TRANSITIONS.items() if not targets)
+
+# Строки, которые раньше хранились в orders.status, для перевода старых записей в коды
+LEGACY_STATUS_CODES = {
+    "Ожидает оплаты": OrderStatus.AWAITING_PAYMENT,
+    "Оплачено": OrderStatus.PAID,
+    "Ожидает подтверждения⏳": OrderStatus.AWAITING_CONFIRMATION,
+    "Ордер завершен администратором✅": OrderStatus.COMPLETED,
+    "Ордер отменен администратором❌": OrderStatus.CANCELED_BY_ADMIN,
+    "Ордер отменен администратором": OrderStatus.CANCELED_BY_ADMIN,
+    "Ордер отменен пользователем": OrderStatus.CANCELED_BY_USER,
+}
+
+
+def status_text(code) -> str:
+    """Текст статуса по коду, для неизвестного кода — сам код"""
+    try:
+        return STATUS_TEXT[OrderStatus(code)]
+    except ValueError:
+        return str(code)
+
+
+def can_transition(current, new) -> bool:
+    """Можно ли перевести ордер из статуса current в new"""
+    try:
+        return OrderStatus(new) in TRANSITIONS[OrderStatus(current)]
+    except ValueError:
+        return False
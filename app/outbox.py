@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+from app.database.requests import claim_outbox_messages, mark_outbox_sent, reschedule_outbox_message
+from app.metrics import metrics
+from config import ADMIN
+
+
+OUTBOX_BATCH_SIZE = 50
+# Как часто проверять outbox, если воркер не разбудили раньше
+OUTBOX_POLL_INTERVAL = 5
+OUTBOX_CONCURRENCY = 5
+OUTBOX_MAX_ATTEMPTS = 5
+# Пауза перед повтором, удваивается с каждой попыткой
+OUTBOX_RETRY_DELAY = 5
+# Сколько секунд захваченное уведомление принадлежит процессу; после падения его заберёт другой
+OUTBOX_LEASE = 300
+
+outbox_event = asyncio.Event()
+
+# Ссылка на воркер, чтобы задачу не собрал сборщик мусора
+outbox_tasks: set[asyncio.Task] = set()
+
+
+def outbox_message(text: str = None, chat_id: int = None, photo: str = None,
+                   reply_markup: InlineKeyboardMarkup = None, dedupe_key: str = None) -> dict:
+    """
+    Уведомление для outbox
+
+    Без chat_id уведомление получит владелец ордера, в транзакции которого оно записано.
+    """
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "photo": photo,
+        "reply_markup": reply_markup.model_dump(exclude_none=True) if reply_markup else None,
+        "dedupe_key": dedupe_key,
+    }
+
+
+def admin_outbox_messages(text: str = None, photo: str = None, reply_markup: InlineKeyboardMarkup = None,
+                          dedupe_key: str = None) -> list:
+    """Одно уведомление на каждого администратора, dedupe_key дополняется chat_id"""
+    return [
+        outbox_message(text, admin_id, photo, reply_markup, f"{dedupe_key}:{admin_id}" if dedupe_key else None)
+        for admin_id in ADMIN
+    ]
+
+
+def wake_outbox():
+    """Будит воркер сразу после записи уведомлений, не дожидаясь опроса"""
+    outbox_event.set()
+
+
+async def _deliver(bot: Bot, message: dict, semaphore: asyncio.Semaphore) -> bool:
+    markup = InlineKeyboardMarkup.model_validate(message["reply_markup"]) if message["reply_markup"] else None
+    attempts = message["attempts"] + 1
+    async with semaphore:
+        try:
+            if message["photo"]:
+                await bot.send_photo(message["chat_id"], message["photo"], caption=message["text"],
+                                     reply_markup=markup)
+            else:
+                await bot.send_message(message["chat_id"], message["text"], reply_markup=markup)
+        except TelegramRetryAfter as e:
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=e.retry_after)
+            error = str(e)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Повтор не поможет: бот заблокирован или сообщение неверное
+            logging.error(f"Outbox message {message['id']} to {message['chat_id']} rejected: {e}")
+            await reschedule_outbox_message(message["id"], attempts, str(e))
+            return False
+        except Exception as e:
+            next_attempt_at = datetime.utcnow() + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+            error = str(e)
+        else:
+            # Отмечаем сразу после отправки: при падении посреди пачки уже доставленное не уйдёт повторно
+            await mark_outbox_sent([message["id"]])
+            return True
+
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        logging.error(f"Outbox message {message['id']} to {message['chat_id']} failed after {attempts} attempts: "
+                      f"{error}")
+        next_attempt_at = None
+    else:
+        logging.warning(f"Outbox message {message['id']} to {message['chat_id']} will be retried: {error}")
+    await reschedule_outbox_message(message["id"], attempts, error, next_attempt_at)
+    return False
+
+
+async def drain_outbox(bot: Bot) -> int:
+    """Отправляет одну пачку уведомлений, возвращает её размер"""
+    now = datetime.utcnow()
+    batch = await claim_outbox_messages(now, OUTBOX_BATCH_SIZE, now + timedelta(seconds=OUTBOX_LEASE))
+    if not batch:
+        return 0
+
+    semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+    results = await asyncio.gather(*(_deliver(bot, message, semaphore) for message in batch))
+    sent = sum(results)
+
+    metrics.inc("outbox_sent", sent)
+    metrics.inc("outbox_failed", len(batch) - sent)
+    return len(batch)
+
+
+async def run_outbox_worker(bot: Bot):
+    """
+    Фоновая доставка уведомлений из outbox
+
+    Уведомление захватывается процессом на OUTBOX_LEASE секунд и отмечается
+    отправленным сразу после доставки. Если процесс упал до отметки, после
+    окончания аренды уведомление заберёт следующий запуск или другой процесс.
+    """
+    while True:
+        outbox_event.clear()
+        try:
+            processed = await drain_outbox(bot)
+        except Exception as e:
+            logging.error(f"Error in outbox worker: {e}")
+            processed = 0
+
+        if processed == OUTBOX_BATCH_SIZE:
+            # Полная пачка — вероятно, есть ещё
+            continue
+        try:
+            await asyncio.wait_for(outbox_event.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox_worker(bot: Bot) -> asyncio.Task:
+    task = asyncio.create_task(run_outbox_worker(bot))
+    outbox_tasks.add(task)
+    task.add_done_callback(outbox_tasks.discard)
+    return task
@@ -0,0 +1,41 @@
+import time
+
+from app.money import to_decimal, uah_amount, usdt_amount, USDT_PLACES, UAH_PLACES
+
+
+# Сколько секунд действует курс, показанный пользователю перед подтверждением
+QUOTE_TTL = 300
+
+
+def lock_quote(original_value, original_currency: str, rate, network: str, wallet: str,
+               bank_card: str, phone_number: str = None) -> dict:
+    """
+    Фиксирует условия ордера на момент предпросмотра
+
+    Котировка хранится в FSM, поэтому при подтверждении не нужно снова читать
+    курс и профиль: ордер создаётся ровно с теми суммами, которые видел пользователь.
+    Числа хранятся строками, чтобы не терять точность Decimal.
+    """
+    if original_currency == 'USDT':
+        usdt_value = to_decimal(original_value, USDT_PLACES)
+        uah_value = uah_amount(original_value, rate)
+    else:  # UAH
+        usdt_value = usdt_amount(original_value, rate)
+        uah_value = to_decimal(original_value, UAH_PLACES)
+
+    return {
+        "original_currency": original_currency,
+        "usdt_value": str(usdt_value),
+        "uah_value": str(uah_value),
+        "rate": str(rate),
+        "network": network,
+        "wallet": wallet,
+        "bank_card": bank_card,
+        "phone_number": phone_number,
+        "expires_at": time.time() + QUOTE_TTL,
+    }
+
+
+def quote_expired(quote: dict) -> bool:
+    """Истёк ли срок котировки; отсутствующая котировка считается истёкшей"""
+    return not quote or quote["expires_at"] < time.time()
@@ -73,4 +73,7 @@ class Mailing(StatesGroup):
     waiting_for_photo = State()
     waiting_for_button_text = State()
     waiting_for_button_url = State()
+    waiting_for_segment = State()
+    waiting_for_inactive_date = State()
     confirm_mailing = State()
+    waiting_for_schedule = State()
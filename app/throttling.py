@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.metrics import metrics
+
+
+# Глобальный лимит Telegram — около 30 сообщений в секунду на бота
+GLOBAL_RATE = 30
+# В личный чат — не больше сообщения в секунду, в группу — 20 в минуту
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3
+# Сколько чатов держать в памяти для учёта их лимитов
+MAX_TRACKED_CHATS = 10000
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду, ожидающие обслуживаются по очереди"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        # Меньше одного токена ведро не накопит никогда, поэтому ёмкость не ниже 1
+        self.capacity = max(capacity or rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """
+        Уводит ведро в минус, чтобы все ожидающие подождали seconds секунд
+
+        Одновременные паузы перекрываются, а не складываются: ведро оживает
+        в max(уже назначенное время, сейчас + seconds).
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Ограничивает исходящие запросы бота к Telegram API
+
+    Запросы в конкретный чат проходят через общее ведро бота и ведро этого чата,
+    поэтому уведомления, ответы и рассылки не мешают друг другу всплесками.
+    На RetryAfter запрос ждёт указанное время и повторяется автоматически.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE):
+        self.global_bucket = TokenBucket(rate)
+        self.chat_buckets: OrderedDict = OrderedDict()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(GROUP_CHAT_RATE if is_group else PRIVATE_CHAT_RATE, CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > MAX_TRACKED_CHATS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        # Служебные запросы (getUpdates, answerCallbackQuery и т.п.) не ограничиваем
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(MAX_RETRIES):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            metrics.inc("api_requests")
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.inc("api_retry_after")
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                logging.warning(f"RetryAfter {e.retry_after}s on {type(method).__name__} to {chat_id}")
+                # Следующий запрос любого чата дождётся окончания паузы в глобальном ведре
+                self.global_bucket.pause(e.retry_after)
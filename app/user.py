@@ -1,27 +1,33 @@
 import re
-import random
+import uuid
 import logging
 from datetime import datetime
+from decimal import Decimal
 
 from aiogram import Router, F
 from aiogram.types import Message, ReplyKeyboardRemove, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import CommandStart
 
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.states import Form, OrderForm, NicknameChange, BankCardChange, OrderCancel, OrderPaid, OrderInfo
 
 from app.database.requests import (
-    set_user, update_user_data, get_user_info, update_nickname, update_bank_card,
-    create_order, get_rate, get_wallets, get_order_info, get_support_contact,
-    update_order_status, get_order_status, get_orders_page_with_total_for_user, is_profile_complete
+    set_user, save_registration, get_user_info, update_nickname, update_bank_card,
+    create_order, get_rate, get_order_info, get_support_contact,
+    transition_order_status, get_order_status, get_orders_page_with_total_for_user, is_profile_complete
 )
 
 from app.middlewares import ProfileCheckMiddleware
+from app.wallet_pool import wallet_pool
+from app.order_status import OrderStatus, FINAL_STATUSES, can_transition, status_text
+from app.money import parse_amount, uah_amount, format_amount, format_rate
+from app.quote import lock_quote, quote_expired
 
 from app.user_keyboard import *
 from app.admin_keyboards import admin_order_actions
-from config import ADMIN
+from app.outbox import admin_outbox_messages, wake_outbox
 from app.luhn import validate_card
 
 logging.basicConfig(level=logging.INFO)
@@ -32,16 +38,15 @@ user = Router()
 user.message.middleware(ProfileCheckMiddleware())
 
 
-@user.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+@user.message(CommandStart(), flags={"skip_profile_check": True})
+async def cmd_start(message: Message, state: FSMContext, session: AsyncSession):
     tg_id = message.from_user.id
     username = message.from_user.username
     full_name = message.from_user.full_name
 
-    user_exists = await set_user(tg_id, username, full_name)
-    if user_exists:
-        user_info = await get_user_info(tg_id)
-        if await is_profile_complete(tg_id):
+    created = await set_user(tg_id, username, full_name, session=session)
+    if not created:
+        if await is_profile_complete(tg_id, session=session):
             await message.answer('Добро пожаловать!\n...', reply_markup=user_main_keyboard)
         else:
             await message.answer('Пожалуйста, завершите регистрацию, отправив номер телефона.', reply_markup=phone_button)
@@ -52,24 +57,23 @@ async def cmd_start(message: Message, state: FSMContext):
 
 @user.message(Form.phone_number, F.contact)
 async def process_phone_number(message: Message, state: FSMContext):
+    # Поля регистрации копятся в FSM и пишутся в БД одним запросом в конце
     phone_number = message.contact.phone_number
-    tg_id = message.from_user.id
-    await update_user_data(tg_id, 'phone_number', phone_number)
-    logging.info(f"Сохранён телефон {phone_number} для tg_id={tg_id}")
+    await state.update_data(phone_number=phone_number)
+    logging.info(f"Получен телефон {phone_number} для tg_id={message.from_user.id}")
     await message.answer('Теперь введите ваш никнейм.', reply_markup=ReplyKeyboardRemove())
     await state.set_state(Form.nickname)
 
 @user.message(Form.nickname)
 async def process_nickname(message: Message, state: FSMContext):
     nickname = message.text
-    tg_id = message.from_user.id
-    await update_user_data(tg_id, 'nickname', nickname)
-    logging.info(f"Сохранён никнейм {nickname} для tg_id={tg_id}")
+    await state.update_data(nickname=nickname)
+    logging.info(f"Получен никнейм {nickname} для tg_id={message.from_user.id}")
     await message.answer('Теперь введите номер вашей банковской карты.')
     await state.set_state(Form.bank_card)
 
 @user.message(Form.bank_card)
-async def process_bank_card(message: Message, state: FSMContext):
+async def process_bank_card(message: Message, state: FSMContext, session: AsyncSession):
     bank_card = message.text
     tg_id = message.from_user.id
 
@@ -77,17 +81,31 @@ async def process_bank_card(message: Message, state: FSMContext):
         await message.answer('Пожалуйста, введите корректный номер карты (16 цифр).')
         return
 
-    await update_user_data(tg_id, 'bank_card', bank_card)
-    logging.info(f"Сохранена карта {bank_card} для tg_id={tg_id}")
+    data = await state.get_data()
+    if not data.get('phone_number') or not data.get('nickname'):
+        # Данные регистрации потеряны (например, после перезапуска бота) — начинаем заново
+        await message.answer('Пожалуйста, отправьте ваш номер телефона.', reply_markup=phone_button)
+        await state.set_state(Form.phone_number)
+        return
+
+    saved = await save_registration(tg_id, data['phone_number'], data['nickname'], int(bank_card),
+                                    username=message.from_user.username,
+                                    full_name=message.from_user.full_name,
+                                    session=session)
+    if not saved:
+        await message.answer('Не удалось сохранить данные. Пожалуйста, попробуйте еще раз.')
+        return
+
+    logging.info(f"Регистрация завершена для tg_id={tg_id}")
     await message.answer('Спасибо! Вы прошли регистрацию.', reply_markup=user_main_keyboard)
     await state.clear()
 
 
 # Вывод информации о профиле
 @user.message(F.text == 'Информация о профиле⚙️')
-async def profile_info(message: Message, state: FSMContext):
+async def profile_info(message: Message, state: FSMContext, session: AsyncSession):
     tg_id = message.from_user.id
-    if not await is_profile_complete(tg_id):
+    if not await is_profile_complete(tg_id, session=session):
         await message.answer(
             "Ваш профиль не заполнен. Пожалуйста, завершите регистрацию, отправив номер телефона.",
             reply_markup=phone_button
@@ -95,7 +113,7 @@ async def profile_info(message: Message, state: FSMContext):
         await state.set_state(Form.phone_number)
         return
 
-    user_info = await get_user_info(tg_id)
+    user_info = await get_user_info(tg_id, session=session)
     if user_info:
         profile_details = (
             f"🆔ID: {user_info['tg_id']}\n"
@@ -117,12 +135,12 @@ async def change_nickname(callback: CallbackQuery, state: FSMContext):
 
 
 @user.message(NicknameChange.waiting_for_new_nickname)
-async def process_nickname(message: Message, state: FSMContext):
+async def process_nickname(message: Message, state: FSMContext, session: AsyncSession):
     new_nickname = message.text
     tg_id = message.from_user.id
 
     # Обновляем никнейм в базе данных
-    await update_nickname(tg_id, new_nickname)
+    await update_nickname(tg_id, new_nickname, session=session)
 
     await message.answer(f"Никнейм успешно обновлен на: {new_nickname}")
 
@@ -139,7 +157,7 @@ async def change_bank_card(callback: CallbackQuery, state: FSMContext):
 
 
 @user.message(BankCardChange.waiting_for_new_bank_card)
-async def process_bank_card(message: Message, state: FSMContext):
+async def process_bank_card(message: Message, state: FSMContext, session: AsyncSession):
     new_bank_card = message.text
     tg_id = message.from_user.id
 
@@ -154,7 +172,7 @@ async def process_bank_card(message: Message, state: FSMContext):
         return
 
     # Обновляем банковскую картку в базе данных
-    await update_bank_card(tg_id, new_bank_card)
+    await update_bank_card(tg_id, new_bank_card, session=session)
 
     await message.answer(f"Банковская карта успешно обновлена на: {new_bank_card}")
 
@@ -171,9 +189,9 @@ async def support_info(message: Message):
 
 
 @user.message(F.text == "Продать USDT💵")
-async def start_order(message: Message, state: FSMContext):
+async def start_order(message: Message, state: FSMContext, session: AsyncSession):
     tg_id = message.from_user.id
-    if not await is_profile_complete(tg_id):
+    if not await is_profile_complete(tg_id, session=session):
         await message.answer(
             "Ваш профиль не заполнен. Пожалуйста, завершите регистрацию, отправив номер телефона.",
             reply_markup=phone_button
@@ -220,24 +238,14 @@ async def process_value(message: Message, state: FSMContext):
             await state.set_state(OrderForm.currency)
             return
 
-        value = float(message.text)
+        value = parse_amount(message.text)
         data = await state.get_data()
         currency = data['currency']
-        rate = await get_rate()
-
-        if currency == 'USDT':
-            usdt_amount = value
-            uah_amount = value * rate
-        else:  # UAH
-            usdt_amount = value / rate
-            uah_amount = value
 
-        # Сохраняем обе суммы в state
+        # Пересчёт по курсу делается один раз при предпросмотре, когда курс фиксируется в котировке
         await state.update_data(
-            value=usdt_amount,  # Всегда сохраняем значение в USDT
-            original_value=value,  # Изначально введенное значение
-            original_currency=currency,  # Валюта, в которой пользователь вводил сумму
-            converted_value=uah_amount if currency == 'USDT' else usdt_amount  # Сконвертированное значение
+            original_value=str(value),  # Изначально введенное значение
+            original_currency=currency  # Валюта, в которой пользователь вводил сумму
         )
 
         await message.answer("Выберите сеть для перевода:", reply_markup=networks_keyboard)
@@ -251,7 +259,7 @@ async def process_value(message: Message, state: FSMContext):
 
 
 @user.message(OrderForm.network)
-async def process_network(message: Message, state: FSMContext):
+async def process_network(message: Message, state: FSMContext, session: AsyncSession):
     if message.text == "Вернуться🔙":
         data = await state.get_data()
         await message.answer(
@@ -263,84 +271,87 @@ async def process_network(message: Message, state: FSMContext):
 
     network = message.text
     await state.update_data(network=network)
-    await show_order_summary(message, state)
+    await show_order_summary(message, state, session=session)
     logging.info(f"User {message.from_user.id} selected network: {network}")
 
 
 @user.message(OrderForm.confirm_order)
-async def process_confirmation(message: Message, state: FSMContext):
+async def process_confirmation(message: Message, state: FSMContext, session: AsyncSession):
     if message.text == "Вернуться🔙":
         await message.answer("Выберите сеть для перевода:", reply_markup=networks_keyboard)
         await state.set_state(OrderForm.network)
         return
     elif message.text in ["Подтвердить", "Отменить"]:
-        await confirm_order(message, state)
+        await confirm_order(message, state, session=session)
 
 
 @user.message(OrderForm.confirm_order, F.text.in_(["Подтвердить", "Отменить"]))
-async def confirm_order(message: Message, state: FSMContext):
+async def confirm_order(message: Message, state: FSMContext, session: AsyncSession):
     if message.text == "Подтвердить":
+        data = await state.get_data()
+        quote = data.get('quote')
+        if quote_expired(quote):
+            # Курс мог измениться, показываем пользователю новые условия
+            await message.answer("Время на подтверждение истекло, курс обновлен.")
+            await show_order_summary(message, state, session=session)
+            return
+
         try:
-            data = await state.get_data()
-            user_info = await get_user_info(message.from_user.id)
-            rate = await get_rate()
+            rate = Decimal(quote['rate'])
+            value = Decimal(quote['usdt_value'])
 
-            # Создаем заказ в базе данных и получаем его ID
+            def admin_notifications(new_order_id: int) -> list:
+                # Формируем текст уведомления для администраторов с учетом исходной валюты
+                original_currency = quote['original_currency']
+                admin_notification = (
+                    f"🆕 Новый ордер!\n\n"
+                    f"📋 Информация о заказе:\n"
+                    f"🔢 ID ордера: {new_order_id}\n"
+                    f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username}) "
+                    f"ID:{message.from_user.id}\n"
+                    f"📱 Телефон: {quote['phone_number']}\n"
+                    f"💰 Исходная валюта: {original_currency}\n"
+                    f"💵 Сумма: {uah_amount(value, rate)} UAH "
+                    f"(≈ {format_amount(value)} USDT)\n"
+                    f"💱Курс обмена: {format_rate(rate)}\n"
+                    f"🌐 Сеть: {quote['network']}\n"
+                    f"💳 Номер карты: {quote['bank_card']}\n"
+                    f"👛 Кошелек для получения: {quote['wallet']}\n"
+                    f"⏳ Статус: {status_text(OrderStatus.AWAITING_PAYMENT)}"
+                )
+                return admin_outbox_messages(admin_notification, reply_markup=admin_order_actions,
+                                             dedupe_key=f"order:{new_order_id}:created")
+
+            # Создаем заказ в базе данных одним INSERT ... RETURNING, уведомления
+            # администраторам пишутся в outbox в той же транзакции
             # Важно: всегда сохраняем значение в USDT
-            order_id = await create_order(
+            order_info, created = await create_order(
                 user_id=message.from_user.id,
                 currency='USDT',  # Всегда сохраняем как USDT
-                value=str(data['value']),  # Значение в USDT
+                value=value,  # Значение в USDT
                 exchange_rate=rate,
-                network=data['network'],
-                bank_card=user_info['bank_card'],
-                wallet=data['wallet']
+                network=quote['network'],
+                bank_card=quote['bank_card'],
+                wallet=quote['wallet'],
+                idempotency_key=data['idempotency_key'],
+                notifications=admin_notifications,
+                session=session
             )
 
-            if not order_id:
-                raise ValueError("Failed to create order: no order ID returned")
-
-            order_info = await get_order_info(order_id)
-
             if not order_info:
-                raise ValueError(f"Failed to get order info for order ID: {order_id}")
+                raise ValueError("Failed to create order: no order returned")
 
-            # Формируем текст уведомления для администраторов с учетом исходной валюты
-            original_currency = data.get('original_currency', 'USDT')
-            admin_notification = (
-                f"🆕 Новый ордер!\n\n"
-                f"📋 Информация о заказе:\n"
-                f"🔢 ID ордера: {order_info['id']}\n"
-                f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username}) ID:{message.from_user.id}\n"
-                f"📱 Телефон: {user_info['phone_number']}\n"
-                f"💰 Исходная валюта: {original_currency}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-                f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
-                f"🌐 Сеть: {order_info['network']}\n"
-                f"💳 Номер карты: {order_info['bank_card']}\n"
-                f"👛 Кошелек для получения: {order_info['wallet']}\n"
-                f"⏳ Статус: {order_info['status']}"
-            )
-
-            # Отправляем уведомление всем администраторам
-            for admin_id in ADMIN:
-                try:
-                    await message.bot.send_message(
-                        chat_id=admin_id,
-                        text=admin_notification,
-                        reply_markup=admin_order_actions
-                    )
-                    logging.info(f"Notification sent to admin {admin_id}")
-                except Exception as e:
-                    logging.error(f"Failed to send notification to admin {admin_id}: {e}")
+            order_id = order_info['id']
+            if created:
+                wake_outbox()
+                wallet_pool.mark_assigned(quote['wallet'])
 
             # Уведомление для пользователя
             user_notification = (
                 f"🔢 ID ордера: {order_info['id']}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-                f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-                f"💱Курс обмена: {order_info['exchange_rate']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+                f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+                f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
                 f"🌐 Сеть: {order_info['network']}\n"
                 f"💳 Номер карты для получения UAH: <code>{order_info['bank_card']}</code>\n"
                 f"👛 Кошелек для перевода USDT: <code>{order_info['wallet']}</code>\n"
@@ -373,10 +384,10 @@ async def confirm_order(message: Message, state: FSMContext):
 
 
 @user.message(F.text == "Назад")
-async def go_back(message: Message, state: FSMContext):
+async def go_back(message: Message, state: FSMContext, session: AsyncSession):
     current_state = await state.get_state()
     if current_state == OrderForm.value:
-        await start_order(message, state)
+        await start_order(message, state, session=session)
     elif current_state == OrderForm.network:
         await state.set_state(OrderForm.currency)
         await message.answer("Выберите валюту для ввода суммы:", reply_markup=usdtuah_keyboard)
@@ -389,17 +400,16 @@ async def go_back(message: Message, state: FSMContext):
     logging.info(f"User {message.from_user.id} went back from state {current_state}")
 
 
-async def show_order_summary(message: Message, state: FSMContext):
+async def show_order_summary(message: Message, state: FSMContext, session: AsyncSession = None):
     try:
         # Получаем данные из состояния
         data = await state.get_data()
         user_id = message.from_user.id
-        user_info = await get_user_info(user_id)
+        user_info = await get_user_info(user_id, session=session)
 
-        # Получаем доступный кошелек
-        wallets = await get_wallets()
-        matching_wallets = [w for w in wallets if w.network == data['network']]
-        wallet = random.choice(matching_wallets).address if matching_wallets else None
+        # Получаем доступный кошелек из пула выбранной сети
+        picked_wallet = await wallet_pool.pick(data['network'])
+        wallet = picked_wallet.address if picked_wallet else None
 
         if not wallet:
             # Вместо очистки состояния возвращаем пользователя к выбору сети
@@ -410,35 +420,31 @@ async def show_order_summary(message: Message, state: FSMContext):
             await state.set_state(OrderForm.network)  # Возвращаем в состояние выбора сети
             return
 
-        # Получаем актуальный курс из БД
-        exchange_rate = await get_rate()
-
-        # Сохраняем данные в состояние для последующего создания ордера
-        await state.update_data(
-            wallet=wallet,
-            bank_card=user_info['bank_card']
-        )
-
-        # Формируем предварительный просмотр заказа с учетом исходной валюты
-        original_currency = data.get('original_currency', 'USDT')
-
         # Проверяем наличие необходимых данных
         if 'original_value' not in data:
             raise ValueError("Missing original_value in state data")
 
-        # Формируем строку с суммой в зависимости от валюты
-        if original_currency == 'USDT':
-            uah_amount = float(data['original_value']) * exchange_rate
-            usdt_amount = float(data['original_value'])
-        else:  # UAH
-            uah_amount = float(data['original_value'])
-            usdt_amount = float(data['original_value']) / exchange_rate
+        # Фиксируем курс, суммы, кошелек и данные профиля на время QUOTE_TTL,
+        # при подтверждении ордер создается по ним без повторных запросов
+        quote = lock_quote(
+            original_value=data['original_value'],
+            original_currency=data.get('original_currency', 'USDT'),
+            rate=await get_rate(),
+            network=data['network'],
+            wallet=wallet,
+            bank_card=user_info['bank_card'],
+            phone_number=user_info['phone_number']
+        )
+        # Ключ подтверждения создается один раз на оформление ордера: повторное нажатие
+        # «Подтвердить» вернет уже созданный ордер вместо второго
+        idempotency_key = data.get('idempotency_key') or uuid.uuid4().hex
+        await state.update_data(quote=quote, idempotency_key=idempotency_key)
 
         order_summary = (
-            f"💵 Сумма: {uah_amount:.2f} UAH "
-            f"(≈ {usdt_amount:.2f} USDT)\n"
-            f"🌐 Сеть для отправки: {data['network']}\n"
-            f"💳 Номер карты для получения: {user_info['bank_card']}\n"
+            f"💵 Сумма: {format_amount(quote['uah_value'])} UAH "
+            f"(≈ {format_amount(quote['usdt_value'])} USDT)\n"
+            f"🌐 Сеть для отправки: {quote['network']}\n"
+            f"💳 Номер карты для получения: {quote['bank_card']}\n"
         )
 
         confirm_keyboard = ReplyKeyboardMarkup(
@@ -467,13 +473,13 @@ async def show_order_summary(message: Message, state: FSMContext):
 
 
 @user.callback_query(F.data == "cancel_order_by_user")
-async def cancel_order(callback: CallbackQuery, state: FSMContext):
+async def cancel_order(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     try:
         message_text = callback.message.text
         order_id = int(message_text.split('ID ордера: ')[1].split('\n')[0])
 
         # Проверяем, можно ли изменять статус ордера
-        if not await can_user_modify_order(order_id):
+        if not await can_user_modify_order(order_id, session=session):
             await callback.message.answer(
                 "Этот ордер уже обработан администратором и не может быть изменен.",
                 reply_markup=user_main_keyboard
@@ -497,7 +503,7 @@ async def cancel_order(callback: CallbackQuery, state: FSMContext):
 
 
 @user.message(OrderCancel.awaiting_confirmation, F.text == "Отменить❌")
-async def confirm_cancel(message: Message, state: FSMContext):
+async def confirm_cancel(message: Message, state: FSMContext, session: AsyncSession):
     try:
         # Получаем данные из состояния
         data = await state.get_data()
@@ -507,13 +513,18 @@ async def confirm_cancel(message: Message, state: FSMContext):
         if not order_id:
             raise ValueError("ID ордера не найден")
 
-        # Обновляем статус ордера в базе данных
-        await update_order_status(order_id, "Ордер отменен пользователем")
-
-        # Получаем обновленную информацию об ордере
-        order_info = await get_order_info(order_id)
+        # Отменяем ордер одним условным UPDATE, уведомление администраторам пишется в outbox
+        order_info = await transition_order_status(
+            order_id, OrderStatus.CANCELED_BY_USER,
+            notifications=admin_outbox_messages(
+                f"❌ Ордер ID № {order_id} был отменен пользователем",
+                dedupe_key=f"order:{order_id}:status:{OrderStatus.CANCELED_BY_USER.value}"
+            ),
+            session=session
+        )
 
         if order_info:
+            wake_outbox()
             # Удаляем сообщение с информацией об ордере
             if original_message_id:
                 try:
@@ -524,24 +535,15 @@ async def confirm_cancel(message: Message, state: FSMContext):
                 except Exception as e:
                     logging.error(f"Не удалось удалить сообщение: {e}")
 
-            # Уведомляем администраторов про изменения
-            for admin_id in ADMIN:
-                try:
-                    await message.bot.send_message(
-                        admin_id,
-                        f"❌ Ордер ID № {order_info['id']} был отменен пользователем"
-                    )
-                except Exception as e:
-                    logging.error(f"Не удалось уведомить администратора {admin_id} о отмене ордера: {e}")
-
             await message.answer(
                 "Ордер успешно отменен!",
                 reply_markup=user_main_keyboard
             )
 
         else:
+            # Ордер не найден или уже завершён/отменён, например администратором
             await message.answer(
-                "Не удалось найти информацию об ордере.",
+                "Этот ордер уже обработан администратором и не может быть изменен.",
                 reply_markup=user_main_keyboard
             )
 
@@ -577,13 +579,13 @@ async def cancel_cancellation(message: Message, state: FSMContext):
 
 
 @user.callback_query(F.data == "order_paid")
-async def process_order_paid(callback: CallbackQuery, state: FSMContext):
+async def process_order_paid(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     try:
         message_text = callback.message.text
         order_id = int(message_text.split('ID ордера: ')[1].split('\n')[0])
 
-        # Check if order can be modified
-        if not await can_user_modify_order(order_id):
+        # Check if order can still be marked as paid
+        if not await can_user_modify_order(order_id, OrderStatus.PAID, session=session):
             await callback.message.answer(
                 "Этот ордер уже обработан администратором и не может быть изменен.",
                 reply_markup=user_main_keyboard
@@ -618,7 +620,7 @@ async def process_order_paid(callback: CallbackQuery, state: FSMContext):
 
 
 @user.message(OrderPaid.waiting_for_screenshot, F.photo)
-async def process_payment_screenshot(message: Message, state: FSMContext):
+async def process_payment_screenshot(message: Message, state: FSMContext, session: AsyncSession):
     try:
         # Get data from state
         data = await state.get_data()
@@ -634,19 +636,47 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
         # Get current UTC time for payment
         payment_time = datetime.utcnow()
 
+        def admin_notifications(order_info: dict) -> list:
+            # Built from the updated order and written to outbox together with the status change
+            admin_notification = (
+                f"💳 Получено подтверждение оплаты!\n\n"
+                f"📋 Информация о заказе:\n"
+                f"🔢 ID ордера: {order_info['id']}\n"
+                f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username})\n"
+                f"💰 Валюта: {order_info['currency']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH\n"
+                f"💱 Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
+                f"💳 Номер карты: {order_info['bank_card']}\n"
+                f"👛 Кошелек для получения: {order_info['wallet']}\n"
+                f"🌐 Сеть: {order_info['network']}\n"
+                f"📅 Создан: {order_info['date_created'].strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"⌚ Время оплаты: {payment_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"⏳ Статус: {status_text(OrderStatus.PAID)}"
+            )
+            return admin_outbox_messages(
+                admin_notification, photo=file_id, reply_markup=admin_order_actions,
+                dedupe_key=f"order:{order_id}:status:{OrderStatus.PAID.value}"
+            )
+
         # Update order status, file_id and payment date
-        success = await update_order_status(
+        order_info = await transition_order_status(
             order_id=order_id,
-            new_status="Оплачено",
+            new_status=OrderStatus.PAID,
             file_id=file_id,
-            payment_date=payment_time
+            payment_date=payment_time,
+            notifications=admin_notifications,
+            session=session
         )
 
-        if not success:
-            raise Exception("Failed to update order status")
-
-        # Get updated order info
-        order_info = await get_order_info(order_id)
+        if not order_info:
+            # Ордер уже оплачен, завершен или отменен
+            await message.answer(
+                "Этот ордер уже обработан администратором и не может быть изменен.",
+                reply_markup=user_main_keyboard
+            )
+            await state.clear()
+            return
+        wake_outbox()
 
         if order_info:
             # Try to delete original order message
@@ -666,36 +696,6 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
                 reply_markup=user_main_keyboard
             )
 
-
-            # Prepare admin notification text
-            admin_notification = (
-                f"💳 Получено подтверждение оплаты!\n\n"
-                f"📋 Информация о заказе:\n"
-                f"🔢 ID ордера: {order_info['id']}\n"
-                f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username})\n"
-                f"💰 Валюта: {order_info['currency']}\n"
-                f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH\n"
-                f"💱 Курс обмена: {order_info['exchange_rate']}\n"
-                f"💳 Номер карты: {order_info['bank_card']}\n"
-                f"👛 Кошелек для получения: {order_info['wallet']}\n"
-                f"🌐 Сеть: {order_info['network']}\n"
-                f"📅 Создан: {order_info['date_created'].strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"⌚ Время оплаты: {order_info['date_payment'].strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"⏳ Статус: {order_info['status']}"
-            )
-
-            # Send notification with screenshot to admins
-            for admin_id in ADMIN:
-                try:
-                    await message.bot.send_photo(
-                        chat_id=admin_id,
-                        photo=file_id,
-                        caption=admin_notification,
-                        reply_markup=admin_order_actions
-                    )
-                except Exception as e:
-                    logging.error(f"Failed to send notification to admin {admin_id}: {e}")
-
         await state.clear()
 
     except Exception as e:
@@ -707,12 +707,11 @@ async def process_payment_screenshot(message: Message, state: FSMContext):
         await state.clear()
 
 
-async def can_user_modify_order(id: int) -> bool:
+async def can_user_modify_order(id: int, new_status: OrderStatus = OrderStatus.CANCELED_BY_USER,
+                                session: AsyncSession = None) -> bool:
 
-    status = await get_order_status(id)
-    if status in ["Ордер завершен администратором✅", "Ордер отменен администратором❌"]:
-        return False
-    return True
+    status = await get_order_status(id, session=session)
+    return can_transition(status, new_status)
 
 
 @user.message(OrderInfo.waiting_for_order_id)
@@ -727,7 +726,7 @@ async def exit_from_request_order_id(message: Message, state: FSMContext):
 
 
 @user.message(OrderInfo.waiting_for_order_id)
-async def process_order_id(message: Message, state: FSMContext):
+async def process_order_id(message: Message, state: FSMContext, session: AsyncSession):
     # Проверяем, является ли введенное значение числом
     if not message.text.isdigit():
         await message.answer(
@@ -737,7 +736,7 @@ async def process_order_id(message: Message, state: FSMContext):
         return
 
     order_id = int(message.text)
-    order_info = await get_order_info(order_id)
+    order_info = await get_order_info(order_id, session=session)
 
     if order_info is None:
         await message.answer(
@@ -762,9 +761,9 @@ async def process_order_id(message: Message, state: FSMContext):
         f"🔢 ID ордера: {order_info['id']}\n"
         f"👤 Пользователь: {order_info['user_id']}\n"
         f"💰 Исходная валюта: {order_info['currency']}\n"
-        f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-        f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-        f"💱Курс обмена: {order_info['exchange_rate']}\n"
+        f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+        f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+        f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
         f"🌐 Сеть: {order_info['network']}\n"
         f"💳 Номер карты: {order_info['bank_card']}\n"
         f"👛 Кошелек для получения: {order_info['wallet']}\n"
@@ -786,7 +785,7 @@ async def process_order_id(message: Message, state: FSMContext):
 
 
 @user.message(OrderPaid.waiting_for_screenshot, F.photo)
-async def handle_payment_screenshot(message: Message, state: FSMContext):
+async def handle_payment_screenshot(message: Message, state: FSMContext, session: AsyncSession):
     try:
         data = await state.get_data()
         order_id = data.get('order_id')
@@ -794,56 +793,42 @@ async def handle_payment_screenshot(message: Message, state: FSMContext):
         # Get the largest photo size file_id
         file_id = message.photo[-1].file_id
 
+        def admin_notifications(order_info: dict) -> list:
+            # Notify admins about payment: screenshot with order information in the caption
+            admin_notification = (
+                f"💳 Оплата получена!\n\n"
+                f"📋 Информация о заказе:\n"
+                f"🔢 ID ордера: {order_info['id']}\n"
+                f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username})\n"
+                f"💰 Валюта: {order_info['currency']}\n"
+                f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH\n"
+                f"💱 Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
+                f"🌐 Сеть: {order_info['network']}\n"
+                f"⏳ Статус: {status_text(OrderStatus.AWAITING_CONFIRMATION)}"
+            )
+            return admin_outbox_messages(
+                admin_notification, photo=file_id, reply_markup=admin_order_actions,
+                dedupe_key=f"order:{order_id}:status:{OrderStatus.AWAITING_CONFIRMATION.value}"
+            )
+
         # Update order status and save file_id
-        success = await update_order_status(
+        order_info = await transition_order_status(
             order_id=order_id,
-            new_status="Ожидает подтверждения⏳",
-            file_id=file_id
+            new_status=OrderStatus.AWAITING_CONFIRMATION,
+            file_id=file_id,
+            notifications=admin_notifications,
+            session=session
         )
 
-        if success:
-            order_info = await get_order_info(order_id)
-            if order_info:
-                # Notify admins about payment
-                admin_notification = (
-                    f"💳 Оплата получена!\n\n"
-                    f"📋 Информация о заказе:\n"
-                    f"🔢 ID ордера: {order_info['id']}\n"
-                    f"👤 Пользователь: {message.from_user.full_name} (@{message.from_user.username})\n"
-                    f"💰 Валюта: {order_info['currency']}\n"
-                    f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH\n"
-                    f"💱 Курс обмена: {order_info['exchange_rate']}\n"
-                    f"🌐 Сеть: {order_info['network']}\n"
-                    f"⏳ Статус: {order_info['status']}"
-                )
-
-                # Send notification with screenshot to admins
-                for admin_id in ADMIN:
-                    try:
-                        # First send the screenshot
-                        await message.bot.send_photo(
-                            chat_id=admin_id,
-                            photo=file_id,
-                            caption="📸 Скриншот оплаты"
-                        )
-                        # Then send order information
-                        await message.bot.send_message(
-                            chat_id=admin_id,
-                            text=admin_notification,
-                            reply_markup=admin_order_actions
-                        )
-                    except Exception as e:
-                        logging.error(f"Failed to send notification to admin {admin_id}: {e}")
-
-                await message.answer(
-                    "✅ Скриншот успешно получен!\n"
-                    "⏳ Ожидайте подтверждения от администратора."
-                )
-                await state.clear()
-            else:
-                await message.answer("❌ Произошла ошибка при получении информации о заказе.")
+        if order_info:
+            wake_outbox()
+            await message.answer(
+                "✅ Скриншот успешно получен!\n"
+                "⏳ Ожидайте подтверждения от администратора."
+            )
+            await state.clear()
         else:
-            await message.answer("❌ Произошла ошибка при обновлении статуса заказа.")
+            await message.answer("Этот ордер уже обработан администратором и не может быть изменен.")
 
     except Exception as e:
         logging.error(f"Error in handle_payment_screenshot: {e}")
@@ -875,9 +860,9 @@ async def invalid_payment_proof(message: Message, state: FSMContext):
 
 
 @user.message(F.text == "Мои ордера🧾")
-async def show_user_orders(message: Message, state: FSMContext):
+async def show_user_orders(message: Message, state: FSMContext, session: AsyncSession):
     user_id = message.from_user.id
-    if not await is_profile_complete(user_id):
+    if not await is_profile_complete(user_id, session=session):
         await message.answer(
             "Ваш профиль не заполнен. Пожалуйста, завершите регистрацию, отправив номер телефона.",
             reply_markup=phone_button
@@ -886,25 +871,20 @@ async def show_user_orders(message: Message, state: FSMContext):
         return
 
     try:
-        orders_data = await get_orders_page_with_total_for_user(user_id, page=1, per_page=5)
-        if not orders_data["orders"]:
+        # Одна выборка первой страницы: и проверка «нет ордеров», и клавиатура
+        orders_data = await get_orders_page_with_total_for_user(user_id, session=session)
+        keyboard = orders_keyboard(user_id, orders_data)
+        if not keyboard:
             await message.answer(
                 "У вас пока нет ордеров.",
                 reply_markup=user_main_keyboard
             )
             return
 
-        keyboard = await build_orders_keyboard(user_id, page=1)
-        if keyboard:
-            await message.answer(
-                "Ваши ордера:",
-                reply_markup=keyboard
-            )
-        else:
-            await message.answer(
-                "Не удалось загрузить список ордеров.",
-                reply_markup=user_main_keyboard
-            )
+        await message.answer(
+            "Ваши ордера:",
+            reply_markup=keyboard
+        )
     except Exception as e:
         logging.error(f"Error showing orders for user {user_id}: {e}")
         await message.answer(
@@ -914,11 +894,11 @@ async def show_user_orders(message: Message, state: FSMContext):
 
 
 @user.callback_query(F.data.startswith("user_order_list_"))
-async def handle_pagination(callback: CallbackQuery):
+async def handle_pagination(callback: CallbackQuery, session: AsyncSession):
     user_id = callback.from_user.id
-    page = int(callback.data.split("_")[3])
+    page, direction, cursor = parse_order_list_callback(callback.data, "user_order_list_")
     try:
-        keyboard = await build_orders_keyboard(user_id, page)
+        keyboard = await build_orders_keyboard(user_id, page, direction, cursor, session=session)
         if keyboard:
             # Проверяем, является ли текущее сообщение фотографией
             if callback.message.photo:
@@ -943,36 +923,31 @@ async def handle_pagination(callback: CallbackQuery):
 
 
 @user.callback_query(F.data.startswith("order_info_"))
-async def show_order_info(callback: CallbackQuery):
+async def show_order_info(callback: CallbackQuery, session: AsyncSession):
     user_id = callback.from_user.id
     order_id = int(callback.data.split("_")[2])
-    order_info = await get_order_info(order_id)
+    order_info = await get_order_info(order_id, session=session)
 
     if order_info and str(order_info["user_id"]) == str(user_id):
         order_message = (
             f"📋 Информация о заказе:\n"
             f"🔢 ID ордера: {order_info['id']}\n"
             f"💰 Исходная валюта: {order_info['currency']}\n"
-            f"💵 Сумма: {float(order_info['value']) * float(order_info['exchange_rate']):.2f} UAH "
-            f"(≈ {float(order_info['value']):.2f} {order_info['currency']})\n"
-            f"💱Курс обмена: {order_info['exchange_rate']}\n"
+            f"💵 Сумма: {uah_amount(order_info['value'], order_info['exchange_rate'])} UAH "
+            f"(≈ {format_amount(order_info['value'])} {order_info['currency']})\n"
+            f"💱Курс обмена: {format_rate(order_info['exchange_rate'])}\n"
             f"🌐 Сеть: {order_info['network']}\n"
             f"💳 Номер карты: {order_info['bank_card']}\n"
             f"👛 Кошелек для получения: {order_info['wallet']}\n"
             f"⏳ Статус: {order_info['status']}"
         )
 
-        # Список статусов, при которых клавиатура не отображается
-        final_statuses = [
-            "Ордер отменен администратором❌",
-            "Ордер завершен администратором✅",
-            "Ордер отменен пользователем",
-            "Оплачено"
-        ]
+        # Статусы, при которых клавиатура не отображается
+        hidden_actions_statuses = FINAL_STATUSES | {OrderStatus.PAID}
 
-        # Создаём клавиатуру только если статус не в списке final_statuses
+        # Создаём клавиатуру только если статус не в списке hidden_actions_statuses
         builder = InlineKeyboardBuilder()
-        if order_info['status'] not in final_statuses:
+        if order_info['status_code'] not in hidden_actions_statuses:
             builder.row(InlineKeyboardButton(
                 text="Пометить, как оплачено✅", callback_data="order_paid"
             ))
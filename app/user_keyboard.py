@@ -1,8 +1,10 @@
 from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton,
                            InlineKeyboardMarkup, InlineKeyboardButton)
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from app.database.requests import get_orders_page_with_total_for_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.requests import get_orders_page_with_total_for_user, encode_order_cursor
 import logging
+from app.order_status import status_text
 
 
 user_main_keyboard = ReplyKeyboardMarkup(keyboard=[
@@ -73,20 +75,80 @@ user_order_info_menu = InlineKeyboardMarkup(inline_keyboard=[
 
 def format_order_button_text(order) -> str:
     """Форматирует текст для кнопки ордера"""
-    return f"ID: {order.id} | {order.currency} | {order.status}"
+    return f"ID: {order.id} | {order.currency} | {status_text(order.status)}"
+
+
+def order_list_callback(prefix: str, page: int, direction: str = None, cursor: str = None) -> str:
+    """Собирает callback_data страницы списка ордеров: prefix_page[_direction_cursor]"""
+    if page <= 1 or not cursor:
+        return f"{prefix}1"
+    return f"{prefix}{page}_{direction}_{cursor}"
+
+
+def parse_order_list_callback(data: str, prefix: str) -> tuple:
+    """Разбирает callback_data из order_list_callback в (page, direction, cursor)"""
+    parts = data.removeprefix(prefix).split("_")
+    page = int(parts[0]) if parts[0] else 1
+    if len(parts) == 3:
+        return page, parts[1], parts[2]
+    return 1, "next", None
+
+
+def order_list_pagination_buttons(prefix: str, page: int, result: dict) -> list:
+    """Кнопки ←/→ с курсорами по первому и последнему ордеру страницы"""
+    orders = result["orders"]
+    total_pages = result["total_pages"]
+    buttons = []
+    if result["has_prev"]:
+        buttons.append(InlineKeyboardButton(
+            text="←",
+            callback_data=order_list_callback(prefix, page - 1, "prev", encode_order_cursor(orders[0]))
+        ))
+    buttons.append(InlineKeyboardButton(
+        text=f"{page}/{total_pages}" if total_pages else str(page),
+        callback_data="current_page"
+    ))
+    if result["has_next"]:
+        buttons.append(InlineKeyboardButton(
+            text="→",
+            callback_data=order_list_callback(prefix, page + 1, "next", encode_order_cursor(orders[-1]))
+        ))
+    return buttons
 
 
-async def build_orders_keyboard(user_id: int, page: int = 1) -> InlineKeyboardMarkup | None:
-    try:
-        result = await get_orders_page_with_total_for_user(user_id, page)
-        orders = result["orders"]
-        total_pages = result["total_pages"]
+def orders_keyboard(user_id: int, result: dict, page: int = 1) -> InlineKeyboardMarkup | None:
+    """Клавиатура по уже загруженной странице ордеров; None, если ордеров нет"""
+    orders = result["orders"]
+    logging.info(f"Building keyboard for user {user_id}: Orders {len(orders)}, Total pages {result['total_pages']}")
+
+    if not orders:
+        logging.info(f"No orders found for user {user_id}")
+        return None
+
+    builder = InlineKeyboardBuilder()
+    for order in orders:
+        button_text = format_order_button_text(order)
+        logging.info(f"Adding order {order.id} with text: {button_text}")
+        builder.add(InlineKeyboardButton(
+            text=button_text,
+            callback_data=f"order_info_{order.id}"
+        ))
+    builder.adjust(1)
+
+    builder.row(*order_list_pagination_buttons("user_order_list_", page, result))
 
-        logging.info(f"Building keyboard for user {user_id}: Orders {len(orders)}, Total pages {total_pages}")
+    return builder.as_markup()
 
-        if not orders:
-            logging.info(f"No orders found for user {user_id}")
-            return None
+
+async def build_orders_keyboard(user_id: int, page: int = 1, direction: str = "next",
+                                cursor: str = None,
+                                session: AsyncSession = None) -> InlineKeyboardMarkup | None:
+    try:
+        result = await get_orders_page_with_total_for_user(user_id, cursor, direction, session=session)
+        return orders_keyboard(user_id, result, page)
+    except Exception as e:
+        logging.error(f"Error building orders keyboard for user {user_id}: {e}")
+        return None
 
         builder = InlineKeyboardBuilder()
         for order in orders:
@@ -98,22 +160,7 @@ async def build_orders_keyboard(user_id: int, page: int = 1) -> InlineKeyboardMa
             ))
         builder.adjust(1)
 
-        pagination_buttons = []
-        if page > 1:
-            pagination_buttons.append(InlineKeyboardButton(
-                text="←",
-                callback_data=f"user_order_list_{page - 1}"
-            ))
-        pagination_buttons.append(InlineKeyboardButton(
-            text=f"{page}/{total_pages}",
-            callback_data="current_page"
-        ))
-        if page < total_pages:
-            pagination_buttons.append(InlineKeyboardButton(
-                text="→",
-                callback_data=f"user_order_list_{page + 1}"
-            ))
-        builder.row(*pagination_buttons)
+        builder.row(*order_list_pagination_buttons("user_order_list_", page, result))
 
         return builder.as_markup()
     except Exception as e:
@@ -0,0 +1,80 @@
+import time
+import logging
+from collections import deque
+
+from app.database.requests import get_settings, get_open_orders_by_wallet
+
+
+# Стратегия выбора кошелька: round_robin, least_recently_assigned или least_open_orders
+WALLET_STRATEGY = "round_robin"
+# Как часто пересчитывать открытые ордера по кошелькам из БД
+OPEN_ORDERS_REFRESH_INTERVAL = 60
+
+
+class WalletPool:
+    """
+    Выбор кошелька для ордера из снимка настроек, сгруппированного по сети
+
+    Выбор не требует запроса к БД: кошельки сети берутся из снимка,
+    а для least_open_orders счётчики открытых ордеров обновляются
+    в памяти и сверяются с БД раз в OPEN_ORDERS_REFRESH_INTERVAL секунд.
+    """
+
+    def __init__(self, strategy: str = WALLET_STRATEGY):
+        self.strategy = strategy
+        self.version = None
+        self.queues: dict[str, deque] = {}
+        self.last_assigned: dict[str, float] = {}
+        self.open_orders: dict[str, int] = {}
+        self.open_orders_loaded_at = 0.0
+
+    def _sync(self, snapshot):
+        """Перестраивает очереди при смене версии настроек, сохраняя порядок уже известных кошельков"""
+        if snapshot.version == self.version:
+            return
+        queues = {}
+        for network, wallets in snapshot.wallets_by_network.items():
+            old_queue = self.queues.get(network, deque())
+            known = {wallet.id: wallet for wallet in wallets}
+            queue = deque(known.pop(wallet.id) for wallet in old_queue if wallet.id in known)
+            queue.extend(known.values())
+            queues[network] = queue
+        self.queues = queues
+        self.version = snapshot.version
+        self.open_orders_loaded_at = 0.0
+
+    async def _refresh_open_orders(self):
+        if time.monotonic() - self.open_orders_loaded_at < OPEN_ORDERS_REFRESH_INTERVAL:
+            return
+        addresses = [wallet.address for queue in self.queues.values() for wallet in queue]
+        try:
+            self.open_orders = await get_open_orders_by_wallet(addresses)
+            self.open_orders_loaded_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Error loading open orders by wallet: {e}")
+
+    async def pick(self, network: str):
+        """Возвращает кошелек для новой заявки в указанной сети или None"""
+        self._sync(await get_settings())
+        queue = self.queues.get(network)
+        if not queue:
+            return None
+
+        # Кошельков в одной сети единицы, поэтому проход по очереди занимает постоянное время
+        if self.strategy == "least_open_orders":
+            await self._refresh_open_orders()
+            return min(queue, key=lambda wallet: self.open_orders.get(wallet.address, 0))
+        if self.strategy == "least_recently_assigned":
+            return min(queue, key=lambda wallet: self.last_assigned.get(wallet.address, 0.0))
+
+        wallet = queue[0]
+        queue.rotate(-1)
+        return wallet
+
+    def mark_assigned(self, address: str):
+        """Учитывает, что на кошелек создан ордер"""
+        self.last_assigned[address] = time.monotonic()
+        self.open_orders[address] = self.open_orders.get(address, 0) + 1
+
+
+wallet_pool = WalletPool()
@@ -6,16 +6,22 @@ from aiogram.enums import ParseMode
 from app.user import user
 from app.admin import admin
 from app.admin_func.mailing import mailing
+from app.throttling import RateLimitMiddleware
+from app.middlewares import DbSessionMiddleware
 from config import TOKEN
 
 from app.database.models import async_main
+from app.admin_func.broadcast_jobs import resume_broadcast_jobs, start_scheduler
+from app.outbox import start_outbox_worker
 
 
 async def main():
     bot = Bot(token=TOKEN,
               default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    
+    bot.session.middleware(RateLimitMiddleware())
+
     dp = Dispatcher()
+    dp.update.outer_middleware(DbSessionMiddleware())
     dp.include_routers(user, admin, mailing)
     dp.startup.register(startup)
     dp.shutdown.register(shutdown)
@@ -23,8 +29,11 @@ async def main():
     await dp.start_polling(bot)
 
 
-async def startup(dispatcher: Dispatcher):
+async def startup(dispatcher: Dispatcher, bot: Bot):
     await async_main()
+    await resume_broadcast_jobs(bot)
+    start_scheduler(bot)
+    start_outbox_worker(bot)
     print('Starting up...')
 
 
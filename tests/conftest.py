@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py с токеном не хранится в репозитории, для тестов хватает временной SQLite
+if "config" not in sys.modules:
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        config = types.ModuleType("config")
+        config.TOKEN = "0:test"
+        config.ADMIN = []
+        config.DB_URL = "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+        sys.modules["config"] = config
+
+from sqlalchemy import insert  # noqa: E402
+
+from app.database.models import Base, User, engine  # noqa: E402
+from app.database.requests import order_totals_cache, profile_complete_cache  # noqa: E402
+
+
+TEST_USER_ID = 1
+
+
+async def reset_database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(table.delete())
+    order_totals_cache.clear()
+    profile_complete_cache.clear()
+
+
+async def add_users(*tg_ids: int):
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [{"tg_id": tg_id} for tg_id in tg_ids])
+
+
+@pytest.fixture
+def db():
+    """Пустая база перед тестом"""
+    asyncio.run(reset_database())
+    return engine
+
+
+@pytest.fixture
+def user_id(db) -> int:
+    """Пустая база с одним пользователем"""
+    asyncio.run(add_users(TEST_USER_ID))
+    return TEST_USER_ID
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from app.admin_func import broadcast_jobs
+from app.admin_func.broadcast_jobs import active_jobs, launch_job, stop_job, resume_broadcast_jobs
+from app.admin_func.broadcaster import WORKERS_COUNT
+from app.database.requests import (create_broadcast_job, get_broadcast_job, set_broadcast_job_status,
+                                   count_pending_recipients, save_broadcast_results)
+from conftest import add_users
+
+
+RECIPIENTS = 60
+ADMIN_CHAT_ID = 1000
+
+
+class FakeBot:
+    """Бот, который запоминает отправленные сообщения вместо обращения к Telegram"""
+
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await asyncio.sleep(0.005)
+        if chat_id != ADMIN_CHAT_ID:
+            self.sent.append(chat_id)
+
+    async def edit_message_text(self, **kwargs):
+        self.edits.append(kwargs)
+
+
+async def start_job(bot: FakeBot) -> int:
+    await add_users(*range(1, RECIPIENTS + 1))
+    job_id = await create_broadcast_job(ADMIN_CHAT_ID, message_text="test")
+    launch_job(bot, job_id)
+    return job_id
+
+
+async def wait_sent(bot: FakeBot, count: int):
+    while len(bot.sent) < count:
+        await asyncio.sleep(0.01)
+
+
+async def wait_finished(job_id: int):
+    active_job = active_jobs.get(job_id)
+    if active_job:
+        await asyncio.wait_for(active_job.task, 10)
+
+
+def test_job_sends_to_every_recipient_once(db):
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_finished(job_id)
+        return bot, await get_broadcast_job(job_id)
+
+    bot, job = asyncio.run(scenario())
+    assert sorted(bot.sent) == list(range(1, RECIPIENTS + 1))
+    assert job["status"] == "finished"
+    assert job["success_count"] == RECIPIENTS
+
+
+def test_pause_stops_sending_and_resume_finishes(db):
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_sent(bot, 10)
+
+        assert await set_broadcast_job_status(job_id, "paused", from_statuses=["running"])
+        stop_job(job_id)
+        sent_at_pause = len(bot.sent)
+        await wait_finished(job_id)
+        sent_after_pause = len(bot.sent)
+        pending = await count_pending_recipients(job_id)
+
+        assert await set_broadcast_job_status(job_id, "running", from_statuses=["paused"])
+        launch_job(bot, job_id)
+        await wait_finished(job_id)
+        return bot, sent_at_pause, sent_after_pause, pending, await get_broadcast_job(job_id)
+
+    bot, sent_at_pause, sent_after_pause, pending, job = asyncio.run(scenario())
+    # После паузы могут уйти только сообщения, которые воркеры уже отправляли
+    assert sent_after_pause - sent_at_pause <= WORKERS_COUNT
+    assert pending == RECIPIENTS - sent_after_pause
+    assert sorted(bot.sent) == list(range(1, RECIPIENTS + 1))
+    assert job["status"] == "finished"
+
+
+def test_pause_does_not_overwrite_progress_message(db, monkeypatch):
+    monkeypatch.setattr(broadcast_jobs, "PROGRESS_INTERVAL", 0.05)
+
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_sent(bot, 5)
+        await set_broadcast_job_status(job_id, "paused", from_statuses=["running"])
+        stop_job(job_id)
+        await wait_finished(job_id)
+        edits = len(bot.edits)
+        await asyncio.sleep(0.2)
+        return edits, len(bot.edits)
+
+    edits_at_stop, edits_later = asyncio.run(scenario())
+    assert edits_later == edits_at_stop
+
+
+def test_cancel_stops_job(db):
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_sent(bot, 10)
+
+        assert await set_broadcast_job_status(job_id, "canceled", from_statuses=["running"])
+        stop_job(job_id)
+        sent_at_cancel = len(bot.sent)
+        await wait_finished(job_id)
+        return bot, sent_at_cancel, await get_broadcast_job(job_id)
+
+    bot, sent_at_cancel, job = asyncio.run(scenario())
+    assert len(bot.sent) - sent_at_cancel <= WORKERS_COUNT
+    assert len(bot.sent) < RECIPIENTS
+    assert job["status"] == "canceled"
+    assert job["success_count"] == len(bot.sent)
+
+
+def test_restart_resumes_from_saved_point(db):
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_sent(bot, 10)
+        # Процесс остановился: задание прервано, в базе оно остаётся running
+        active_jobs[job_id].task.cancel()
+        await asyncio.gather(active_jobs[job_id].task, return_exceptions=True)
+        await set_broadcast_job_status(job_id, "running")
+        sent_before_restart = list(bot.sent)
+
+        restarted_bot = FakeBot()
+        await resume_broadcast_jobs(restarted_bot)
+        await wait_finished(job_id)
+        return sent_before_restart, restarted_bot, await get_broadcast_job(job_id)
+
+    sent_before_restart, restarted_bot, job = asyncio.run(scenario())
+    assert job["status"] == "finished"
+    assert set(sent_before_restart) | set(restarted_bot.sent) == set(range(1, RECIPIENTS + 1))
+    assert len(restarted_bot.sent) == len(set(restarted_bot.sent))
+
+
+def test_failed_result_write_pauses_job(db, monkeypatch):
+    async def failing_save(*args, **kwargs):
+        raise RuntimeError("database is unavailable")
+
+    monkeypatch.setattr(broadcast_jobs, "save_broadcast_results", failing_save)
+
+    async def scenario():
+        bot = FakeBot()
+        job_id = await start_job(bot)
+        await wait_finished(job_id)
+        return bot, await get_broadcast_job(job_id), await count_pending_recipients(job_id)
+
+    bot, job, pending = asyncio.run(scenario())
+    # Задание не зациклилось: каждому отправлено не больше одного раза, и оно ждёт администратора
+    assert len(bot.sent) == len(set(bot.sent))
+    assert job["status"] == "paused"
+    assert pending == RECIPIENTS
+
+
+def test_save_broadcast_results_raises_on_database_error(db):
+    async def scenario():
+        await add_users(1)
+        job_id = await create_broadcast_job(ADMIN_CHAT_ID, message_text="test")
+        async with db.begin() as conn:
+            await conn.execute(text("DROP TABLE broadcast_recipients"))
+        await save_broadcast_results(job_id, [1], [])
+
+    with pytest.raises(Exception):
+        asyncio.run(scenario())
@@ -0,0 +1,19 @@
+from app.metrics import Metrics
+
+
+def test_render_lists_counters_and_gauges():
+    registry = Metrics()
+    registry.inc("outbox_sent", 3)
+    registry.inc("api_requests")
+    registry.set("broadcast_active_jobs", 2)
+
+    report = registry.render()
+    assert "api_requests: 1" in report
+    assert "outbox_sent: 3" in report
+    assert "broadcast_active_jobs: 2" in report
+    assert report.index("api_requests") < report.index("outbox_sent")
+
+
+def test_render_without_data_shows_uptime_only():
+    assert Metrics().render().startswith("⏱ Аптайм:")
+    assert "Счётчики" not in Metrics().render()
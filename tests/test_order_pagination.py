@@ -0,0 +1,98 @@
+import asyncio
+
+from sqlalchemy import insert, text
+
+from app.database.models import Order, engine
+from app.database.migrations import normalize_order_dates
+from app.database.requests import get_orders_page_with_total, get_orders_page_with_total_for_user, encode_order_cursor
+from app.order_status import OrderStatus
+from app.user_keyboard import orders_keyboard
+from conftest import TEST_USER_ID
+
+
+PER_PAGE = 10
+
+
+def order_values(**values):
+    return dict(user_id=TEST_USER_ID, currency="USDT", bank_card=4111111111111111,
+                status=OrderStatus.AWAITING_PAYMENT, **values)
+
+
+async def collect_ids(direction_back: bool = False) -> list:
+    """Листает все страницы вперёд по курсору и возвращает id в порядке показа"""
+    seen = []
+    page = await get_orders_page_with_total(per_page=PER_PAGE)
+    seen.extend(order.id for order in page["orders"])
+    pages = [page]
+    while page["has_next"] and len(pages) <= 10:
+        page = await get_orders_page_with_total(encode_order_cursor(page["orders"][-1]), "next", PER_PAGE)
+        seen.extend(order.id for order in page["orders"])
+        pages.append(page)
+
+    if direction_back:
+        # И обратно: от последней страницы к первой
+        page = pages[-1]
+        back = []
+        while page["has_prev"] and len(back) <= 10:
+            page = await get_orders_page_with_total(encode_order_cursor(page["orders"][0]), "prev", PER_PAGE)
+            back.append([order.id for order in page["orders"]])
+        return seen, back
+    return seen
+
+
+def test_pages_through_new_orders(user_id):
+    async def scenario():
+        async with engine.begin() as conn:
+            for _ in range(25):
+                await conn.execute(insert(Order).values(order_values()))
+        return await collect_ids(direction_back=True)
+
+    seen, back = asyncio.run(scenario())
+    assert len(seen) == len(set(seen)) == 25
+    assert back[-1] == seen[:PER_PAGE]
+
+
+def test_pages_through_orders_sharing_timestamp(user_id):
+    async def scenario():
+        async with engine.begin() as conn:
+            # Строки, вставленные через server_default: формат CURRENT_TIMESTAMP без микросекунд
+            for _ in range(25):
+                await conn.execute(text(
+                    "INSERT INTO orders (user_id, currency, bank_card, status_code, date_created) "
+                    "VALUES (1, 'USDT', 4111111111111111, 1, '2024-05-01 12:00:00')"
+                ))
+        await normalize_order_dates(engine)
+        return await collect_ids(direction_back=True)
+
+    seen, back = asyncio.run(scenario())
+    assert len(seen) == len(set(seen)) == 25
+    assert back[-1] == seen[:PER_PAGE]
+
+
+def test_pages_through_server_default_dates(user_id):
+    async def scenario():
+        async with engine.begin() as conn:
+            for second in range(25):
+                await conn.execute(text(
+                    "INSERT INTO orders (user_id, currency, bank_card, status_code, date_created) "
+                    "VALUES (1, 'USDT', 4111111111111111, 1, :date_created)"
+                ), {"date_created": f"2024-05-01 12:00:{second:02d}"})
+        await normalize_order_dates(engine)
+        return await collect_ids()
+
+    seen = asyncio.run(scenario())
+    assert len(seen) == len(set(seen)) == 25
+
+
+def test_orders_keyboard_from_single_page(user_id):
+    async def scenario():
+        empty = await get_orders_page_with_total_for_user(user_id)
+        async with engine.begin() as conn:
+            await conn.execute(insert(Order), [order_values() for _ in range(PER_PAGE + 1)])
+        return empty, await get_orders_page_with_total_for_user(user_id)
+
+    empty, page = asyncio.run(scenario())
+    assert orders_keyboard(user_id, empty) is None
+    keyboard = orders_keyboard(user_id, page)
+    order_rows = [row for row in keyboard.inline_keyboard if row[0].callback_data.startswith("order_info_")]
+    assert len(order_rows) == PER_PAGE
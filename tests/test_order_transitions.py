@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from sqlalchemy import insert
+
+from app.database.models import Order, engine
+from app.database.requests import transition_order_status
+from app.order_status import OrderStatus
+
+
+async def create_test_order(user_id: int) -> int:
+    async with engine.begin() as conn:
+        return (await conn.execute(
+            insert(Order).values(user_id=user_id, currency="USDT", bank_card=4111111111111111,
+                                 status=OrderStatus.AWAITING_PAYMENT)
+        )).inserted_primary_key[0]
+
+
+def test_second_transition_is_a_conflict(user_id):
+    async def scenario():
+        order_id = await create_test_order(user_id)
+        first = await transition_order_status(order_id, OrderStatus.COMPLETED)
+        second = await transition_order_status(order_id, OrderStatus.CANCELED_BY_ADMIN)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["status_code"] == OrderStatus.COMPLETED
+    assert second is None
+
+
+def test_error_is_raised_and_rolled_back(user_id):
+    def failing_notifications(order_info):
+        raise RuntimeError("outbox is unavailable")
+
+    async def scenario():
+        order_id = await create_test_order(user_id)
+        with pytest.raises(RuntimeError):
+            await transition_order_status(order_id, OrderStatus.PAID, notifications=failing_notifications)
+        # Ордер не изменился, и переход всё ещё возможен
+        return await transition_order_status(order_id, OrderStatus.PAID)
+
+    order_info = asyncio.run(scenario())
+    assert order_info["status_code"] == OrderStatus.PAID
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.database.models import Order, engine, async_session
+from app.database.requests import add_outbox_messages, claim_outbox_messages
+from app.order_status import OrderStatus
+
+
+def test_new_messages_are_due_by_utc_clock(user_id):
+    async def scenario():
+        async with engine.begin() as conn:
+            order_id = (await conn.execute(
+                insert(Order).values(user_id=user_id, currency="USDT", bank_card=4111111111111111,
+                                     status=OrderStatus.AWAITING_PAYMENT)
+            )).inserted_primary_key[0]
+
+        async with async_session() as session:
+            await add_outbox_messages(session, [
+                {"chat_id": 100, "text": "admin", "photo": None, "reply_markup": None, "dedupe_key": "a"},
+                {"chat_id": None, "text": "owner", "photo": None, "reply_markup": None, "dedupe_key": "b"},
+            ], order_id)
+            await session.commit()
+
+        # Опрос чуть раньше текущего UTC ничего не видит, текущий — видит оба уведомления
+        now = datetime.utcnow()
+        lease = now + timedelta(minutes=5)
+        early = await claim_outbox_messages(now - timedelta(minutes=1), 10, lease)
+        due = await claim_outbox_messages(now, 10, lease)
+        return early, due
+
+    early, due = asyncio.run(scenario())
+    assert early == []
+    assert sorted((message["chat_id"], message["text"]) for message in due) == [(user_id, "owner"), (100, "admin")]
+
+
+def test_claimed_messages_are_leased(user_id):
+    async def scenario():
+        async with engine.begin() as conn:
+            order_id = (await conn.execute(
+                insert(Order).values(user_id=user_id, currency="USDT", bank_card=4111111111111111,
+                                     status=OrderStatus.AWAITING_PAYMENT)
+            )).inserted_primary_key[0]
+
+        async with async_session() as session:
+            await add_outbox_messages(session, [
+                {"chat_id": 100, "text": "admin", "photo": None, "reply_markup": None, "dedupe_key": "a"},
+            ], order_id)
+            await session.commit()
+
+        now = datetime.utcnow()
+        lease = now + timedelta(minutes=5)
+        first = await claim_outbox_messages(now, 10, lease)
+        # Пока аренда не истекла, второй процесс сообщение не получает
+        second = await claim_outbox_messages(now, 10, lease)
+        # После окончания аренды незавершённое сообщение забирается снова
+        expired = await claim_outbox_messages(lease + timedelta(seconds=1), 10, lease + timedelta(minutes=5))
+        return first, second, expired
+
+    first, second, expired = asyncio.run(scenario())
+    assert [message["text"] for message in first] == ["admin"]
+    assert second == []
+    assert [message["text"] for message in expired] == ["admin"]
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy import select, update
+
+from app.database.models import User, async_session
+from app.database.requests import set_user
+from app.middlewares import ProfileCheckMiddleware
+from app.user import user, cmd_start
+
+
+class FakeState:
+    def __init__(self):
+        self.state = None
+
+    async def get_state(self):
+        return self.state
+
+    async def set_state(self, state):
+        self.state = state
+
+
+class FakeMessage:
+    def __init__(self, tg_id):
+        self.from_user = SimpleNamespace(id=tg_id)
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+def find_handler(callback):
+    return next(handler for handler in user.message.handlers if handler.callback is callback)
+
+
+async def run_middleware(tg_id, handler_object):
+    message = FakeMessage(tg_id)
+    data = {"state": FakeState(), "handler": handler_object}
+    reached = []
+
+    async def handler(event, data):
+        reached.append(event)
+        await set_user(tg_id)
+
+    await ProfileCheckMiddleware()(handler, message, data)
+    return message, reached
+
+
+def test_start_reaches_handler_and_unblocks_user(user_id):
+    async def scenario():
+        async with async_session() as session:
+            await session.execute(update(User).where(User.tg_id == user_id).values(is_blocked=True))
+            await session.commit()
+
+        message, reached = await run_middleware(user_id, find_handler(cmd_start))
+        async with async_session() as session:
+            blocked = await session.scalar(select(User.is_blocked).where(User.tg_id == user_id))
+        return message, reached, blocked
+
+    message, reached, blocked = asyncio.run(scenario())
+    assert reached and not message.answers
+    assert blocked is False
+
+
+def test_other_handlers_require_complete_profile(user_id):
+    other = next(handler for handler in user.message.handlers if handler.callback is not cmd_start
+                 and not handler.flags.get("skip_profile_check"))
+    message, reached = asyncio.run(run_middleware(user_id, other))
+    assert reached == []
+    assert len(message.answers) == 1
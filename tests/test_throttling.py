@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from app.throttling import TokenBucket, RateLimitMiddleware
+
+
+def test_slow_bucket_releases_tokens():
+    async def scenario():
+        # Скорость ниже одного запроса в секунду, как у растянутой рассылки
+        bucket = TokenBucket(0.5)
+        await asyncio.wait_for(bucket.acquire(), 1)
+        bucket.tokens = 0.99
+        await asyncio.wait_for(bucket.acquire(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_pauses_overlap():
+    async def scenario():
+        bucket = TokenBucket(30)
+
+        async def worker():
+            bucket.pause(5)
+
+        # Десять воркеров получили один и тот же RetryAfter
+        await asyncio.gather(*(worker() for _ in range(10)))
+        return -bucket.tokens / bucket.rate
+
+    resume_in = asyncio.run(scenario())
+    assert 4.9 < resume_in <= 5.01
+
+
+def test_longer_pause_wins():
+    bucket = TokenBucket(30)
+    bucket.pause(5)
+    bucket.pause(1)
+    assert -bucket.tokens / bucket.rate > 4.9
+
+
+def test_middleware_retry_after_waits_once():
+    async def scenario():
+        middleware = RateLimitMiddleware()
+        flood_until = time.monotonic() + 1
+
+        async def make_request(bot, method):
+            # Ответ Telegram приходит не сразу, поэтому все запросы успевают уйти до первого RetryAfter
+            await asyncio.sleep(0.01)
+            if time.monotonic() < flood_until:
+                raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=1)
+            return True
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            middleware(make_request, None, SendMessage(chat_id=chat_id, text="test"))
+            for chat_id in range(1, 11)
+        ))
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(scenario())
+    assert results == [True] * 10
+    # Десять одновременных RetryAfter по 1s — общая пауза около 1s, а не 10s
+    assert elapsed < 2